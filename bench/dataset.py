@@ -0,0 +1,84 @@
+# === СИНТЕТИЧЕСКИЕ ДАННЫЕ ===
+# Генерирует tracked_players.json нужного размера: теги обеих игр, клубы/кланы и
+# историю кубков за несколько месяцев (в формате history.py, уже прореженную так же,
+# как это делает трекер). Последние HOUR_KEEP секунд точки идут с шагом около
+# interval, а более старая часть — по точке в сутки: ярусы, которые её хранят, всё
+# равно суточные (100k тегов генерируются за несколько минут).
+#
+#   python bench/dataset.py --tags 10000 --days 90 --output /tmp/tracked_players.json
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HOUR_KEEP, History  # noqa: E402
+
+TAG_CHARS = '0289PYLQGRJCUV'
+GAMES = ('brawlstars', 'clashroyale')
+
+
+def make_tag(rng, length=9):
+    return '#' + ''.join(rng.choice(TAG_CHARS) for _ in range(length))
+
+
+def make_history(rng, start, now, interval):
+    history = History()
+    timestamp, trophies = start, rng.randint(0, 60000)
+    while timestamp < now:
+        history.append(int(timestamp), trophies)
+        step = 86400 if timestamp < now - HOUR_KEEP else rng.expovariate(1 / interval)
+        timestamp += max(60, step)
+        trophies = max(0, trophies + rng.randint(-10, 40))
+    history.prune_to(history.prune_plan(now))
+    return history
+
+
+def generate(tags, days=90, interval=4 * 3600, club_share=0.5, club_size=20, seed=0, now=None):
+    # {тег: {'name', 'game', 'history', 'club'?}}; половина игроков (club_share) — в клубах по club_size
+    rng = random.Random(seed)
+    now = int(time.time() if now is None else now)
+    players, seen = {}, set()
+    clubs = {game: [] for game in GAMES}
+    for i in range(tags):
+        tag = make_tag(rng)
+        while tag in seen:
+            tag = make_tag(rng)
+        seen.add(tag)
+        game = GAMES[i % len(GAMES)]
+        # Одни игроки отслеживаются с самого начала, другие добавлены позже
+        start = now - rng.uniform(0.1, 1.0) * days * 86400
+        data = {'name': f'bench{i}', 'game': game, 'history': make_history(rng, start, now, interval)}
+        if rng.random() < club_share:
+            if not clubs[game] or len(clubs[game][-1][1]) >= club_size:
+                clubs[game].append((make_tag(rng, 8), []))
+            club, members = clubs[game][-1]
+            members.append(tag)
+            data['club'] = club
+        players[tag] = data
+    return players
+
+
+def save(players, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(players, f, ensure_ascii=False, default=History.to_json)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Генератор tracked_players.json для нагрузочных тестов")
+    parser.add_argument('--tags', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--interval', type=float, default=4 * 3600, help="средний шаг точек истории, секунды")
+    parser.add_argument('--club-share', type=float, default=0.5)
+    parser.add_argument('--club-size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='tracked_players.bench.json')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    save(generate(args.tags, args.days, args.interval, args.club_share, args.club_size, args.seed), args.output)
+    print(f"{args.output}: {args.tags} тегов за {time.perf_counter() - started:.1f} с, "
+          f"{os.path.getsize(args.output) / 2 ** 20:.1f} МБ")
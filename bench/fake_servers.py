@@ -0,0 +1,218 @@
+# === ПОДСТАВНЫЕ СЕРВЕРЫ ДЛЯ НАГРУЗОЧНЫХ ТЕСТОВ ===
+# Локальные HTTP-серверы вместо настоящих сервисов:
+#  - FakeGameAPI — эндпоинты игроков и клубов/кланов Brawl Stars и Clash Royale
+#    (те же пути и формат ответа, что ждут brawlstats и clashroyale) с настраиваемой
+#    задержкой, долей ответов 429 и долей ошибок сервера;
+#  - FakeTelegramAPI — Bot API, который ничего не шлёт, а запоминает сообщения.
+# Клиенты бота направляются сюда переменными BRAWLSTARS_API_URL, CLASHROYALE_API_URL
+# и TELEGRAM_API_URL (см. настройки в main.py).
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class _FakeServer:
+    def __init__(self, host='127.0.0.1', port=0):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _handler_class(self):
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Иначе заголовки и тело уходят разными пакетами и каждый ответ ждёт отложенный ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                # Тело читаем и у GET: клиенты бывают с пустым JSON, а соединение переиспользуется
+                owner._dispatch(self, self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+            do_POST = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _dispatch(self, request, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def _reply(request, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+class FakeGameAPI(_FakeServer):
+    # players — словарь в формате хранилища ({тег: {'name', 'game', 'club', ...}}), из него
+    # берутся имена, составы клубов и стартовые кубки. При каждом запросе кубки тега
+    # с вероятностью activity немного меняются.
+    def __init__(self, game, players=None, latency=0.05, jitter=0.02, rate_429=0.0, error_rate=0.0,
+                 activity=0.3, seed=0, host='127.0.0.1', port=0):
+        self.game = game
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.activity = activity
+        self.throttled = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._names, self._trophies, self._clubs, self._club_of = {}, {}, {}, {}
+        for tag, data in (players or {}).items():
+            if data.get('game') != game:
+                continue
+            self._names[tag] = data.get('name', tag)
+            history = data.get('history')
+            self._trophies[tag] = history.last() if history else 0
+            if data.get('club'):
+                self._clubs.setdefault(data['club'], []).append(tag)
+                self._club_of[tag] = data['club']
+        super().__init__(host, port)
+
+    def _trophies_of(self, tag):
+        with self._lock:
+            trophies = self._trophies.get(tag)
+            if trophies is None:
+                trophies = self._random.randint(0, 60000)
+            elif self._random.random() < self.activity:
+                trophies += self._random.randint(-8, 30)
+            self._trophies[tag] = trophies
+            return trophies
+
+    def player(self, tag):
+        club = self._club_of.get(tag)
+        trophies = self._trophies_of(tag)
+        name = self._names.get(tag, 'bench' + tag[1:5])
+        if self.game == 'brawlstars':
+            return {'tag': tag, 'name': name, 'trophies': trophies, 'highestTrophies': trophies + 100,
+                    'expLevel': 100, '3vs3Victories': 1000, 'soloVictories': 100, 'duoVictories': 100,
+                    'club': {'tag': club, 'name': 'club ' + club} if club else {},
+                    'brawlers': [{'id': 16000000 + i, 'name': f'BRAWLER{i}', 'trophies': 500 + i, 'rank': 20}
+                                 for i in range(30)]}
+        return {'tag': tag, 'name': name, 'trophies': trophies, 'bestTrophies': trophies + 100, 'expLevel': 14,
+                'wins': 1000, 'losses': 900,
+                'clan': {'tag': club, 'name': 'clan ' + club} if club else None,
+                'currentDeck': [{'name': f'Card {i}', 'id': 26000000 + i, 'level': 14} for i in range(8)]}
+
+    def members(self, club):
+        return [{'tag': tag, 'name': self._names.get(tag, tag), 'trophies': self._trophies_of(tag), 'role': 'member'}
+                for tag in self._clubs.get(club, [])]
+
+    def _dispatch(self, request, body):
+        self._count('requests')
+        time.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_429:
+            self._count('throttled')
+            self._reply(request, 429, {'reason': 'requestThrottled', 'message': 'Request was throttled'})
+            return
+        if roll < self.rate_429 + self.error_rate:
+            self._count('errors')
+            self._reply(request, 503, {'reason': 'inMaintenance'})
+            return
+
+        parts = [unquote(part) for part in urlsplit(request.path).path.split('/') if part]
+        # /v1/players/#TAG, /v1/clubs/#TAG/members (BS), /v1/clans/#TAG (CR), /v1/brawlers
+        if parts[1:2] == ['brawlers']:
+            self._reply(request, 200, {'items': []})
+        elif len(parts) >= 3 and parts[1] == 'players':
+            self._reply(request, 200, self.player(parts[2]))
+        elif len(parts) >= 4 and parts[1] == 'clubs' and parts[3] == 'members':
+            self._reply(request, 200, {'items': self.members(parts[2])})
+        elif len(parts) >= 3 and parts[1] == 'clans':
+            members = self.members(parts[2])
+            self._reply(request, 200, {'tag': parts[2], 'name': 'clan ' + parts[2], 'members': len(members),
+                                       'memberList': members})
+        else:
+            self._reply(request, 404, {'reason': 'notFound'})
+
+    @property
+    def api_url(self):
+        return self.url + '/v1'
+
+
+class FakeTelegramAPI(_FakeServer):
+    # Принимает любые методы Bot API; sendMessage запоминает в messages как (chat_id, текст)
+    def __init__(self, latency=0.0, rate_429=0.0, retry_after=1, seed=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.throttled = 0
+        self.messages = []
+        self._random = random.Random(seed)
+        super().__init__(host, port)
+
+    @property
+    def api_url(self):
+        # Формат telebot.apihelper.API_URL: {0} — токен, {1} — метод
+        return self.url + '/bot{0}/{1}'
+
+    def _params(self, request, body):
+        params = {key: values[-1] for key, values in parse_qs(urlsplit(request.path).query).items()}
+        if body and 'json' in (request.headers.get('Content-Type') or ''):
+            params.update(json.loads(body))
+        elif body and 'multipart' not in (request.headers.get('Content-Type') or ''):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+        return params
+
+    def _dispatch(self, request, body):
+        self._count('requests')
+        if self.latency:
+            time.sleep(self.latency)
+        method = urlsplit(request.path).path.rsplit('/', 1)[-1]
+        params = self._params(request, body)
+        with self._lock:
+            throttled = method == 'sendMessage' and self._random.random() < self.rate_429
+        if throttled:
+            self._count('throttled')
+            self._reply(request, 429, {'ok': False, 'error_code': 429,
+                                       'description': f'Too Many Requests: retry after {self.retry_after}',
+                                       'parameters': {'retry_after': self.retry_after}})
+            return
+
+        result = True
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif method == 'sendMessage':
+            chat_id = int(params.get('chat_id', 0))
+            with self._lock:
+                self.messages.append((chat_id, params.get('text', '')))
+                message_id = len(self.messages)
+            result = {'message_id': message_id, 'date': int(time.time()), 'text': params.get('text', ''),
+                      'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'}}
+        self._reply(request, 200, {'ok': True, 'result': result})
@@ -0,0 +1,324 @@
+# === НАГРУЗОЧНЫЙ ПРОГОН ===
+# Гоняет настоящий main.py (обработчики, индекс лидербордов, hourly_tracker) против
+# подставных серверов из fake_servers.py на синтетических данных из dataset.py и
+# пишет результаты в JSON, чтобы сравнивать их между коммитами.
+#
+# Для каждого размера набора:
+#  1. генерируется tracked_players.json и поднимаются подставные API игр и Telegram;
+#  2. в отдельном процессе (чтобы пиковая память считалась только для бота)
+#     импортируется main.py, загружается хранилище и по очереди прогоняются
+#     лидерборды, профили и трекер (на SimulatedClock, без реального ожидания тиков);
+#  3. к замерам процесса добавляются счётчики подставных серверов.
+#
+#   python bench/run.py --tags 1000 10000 --output bench_results.json
+#   python bench/run.py --compare old.json new.json
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_TOKEN = '123456:bench'
+ADMIN_CHAT_ID = 1
+ERROR_MARK = '❌'
+
+# Метрики, которые --compare показывает в первую очередь (меньше — лучше)
+KEY_METRICS = ('startup.migrate_s', 'startup.load_s', 'startup.rebuild_s', 'leaderboard.p50_ms', 'leaderboard.p99_ms',
+               'profile.p50_ms', 'profile.p99_ms', 'tracker.wall_s', 'shutdown.save_s', 'peak_rss_mb')
+
+
+def percentiles(samples):
+    # Задержки в секундах -> сводка в миллисекундах
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+
+    def at(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+    return {'count': len(samples), 'p50_ms': at(0.50), 'p90_ms': at(0.90), 'p99_ms': at(0.99),
+            'max_ms': round(samples[-1] * 1000, 3), 'mean_ms': round(sum(samples) / len(samples) * 1000, 3)}
+
+
+def peak_rss_mb():
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def make_update(update_id, chat_id, text):
+    message = {'message_id': update_id, 'date': int(time.time()), 'text': text,
+               'chat': {'id': chat_id, 'type': 'private'},
+               'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench'}}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+# --- процесс с ботом ---
+def timed_updates(main, texts, concurrency, first_id):
+    # Прогоняет обновления через bot.process_new_updates в concurrency потоках,
+    # возвращает задержку обработки каждого
+    import telebot
+    samples, lock = [], threading.Lock()
+    jobs = iter(enumerate(texts, first_id))
+
+    def work():
+        while True:
+            with lock:
+                job = next(jobs, None)
+            if job is None:
+                return
+            update_id, text = job
+            update = telebot.types.Update.de_json(make_update(update_id, 10 ** 6 + update_id, text))
+            started = time.perf_counter()
+            main.bot.process_new_updates([update])
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.append(elapsed)
+
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def run_worker(args):
+    rng = random.Random(args.seed)
+    result = {}
+
+    started = time.perf_counter()
+    import main
+    import scheduler
+    result['startup'] = {'import_s': round(time.perf_counter() - started, 3)}
+
+    # Тот же порядок запуска, что и в main.py
+    if not main.store.backend.snapshots:
+        started = time.perf_counter()
+        main.storage.migrate_from_json(main.store.backend, main.TRACKED_PLAYERS_FILE)
+        result['startup']['migrate_s'] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    main.store.load()
+    result['startup']['load_s'] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    main.leaderboards.rebuild()
+    result['startup']['rebuild_s'] = round(time.perf_counter() - started, 3)
+    main.store.start()
+    main.outbox.start()
+    # Как в режиме вебхука: обработчик выполняется прямо в вызывающем потоке
+    main.bot.threaded = False
+
+    commands = {'brawlstars': ('бс лидер', '/profilebs'), 'clashroyale': ('клэш лидер', '/profilecr')}
+    periods = list(main.LEADERBOARD_PERIODS) + ['']
+    texts = [f"{commands[rng.choice(list(commands))][0]} {rng.choice(periods)}".strip()
+             for _ in range(args.leaderboard_requests)]
+    result['leaderboard'] = percentiles(timed_updates(main, texts, args.concurrency, 1))
+
+    tags = {game: main.store.tags(game) for game in commands}
+    texts = []
+    for _ in range(args.profile_requests):
+        game = rng.choice([game for game in commands if tags[game]])
+        texts.append(f"{commands[game][1]} {rng.choice(tags[game])}")
+    result['profile'] = percentiles(timed_updates(main, texts, args.concurrency, 10 ** 6))
+
+    # Трекер на симулированных часах: ожидание тиков мгновенное, запросы к API настоящие
+    checks = [0]
+    record_check = main.record_check
+
+    def counting_record_check(*check_args):
+        checks[0] += 1
+        return record_check(*check_args)
+
+    main.record_check = counting_record_check
+    main.tracker_clock = scheduler.SimulatedClock(time.time())
+    start = main.tracker_clock.now()
+    started = time.perf_counter()
+    main.hourly_tracker(until=start + args.tracker_hours * 3600)
+    wall = time.perf_counter() - started
+    result['tracker'] = {'simulated_hours': args.tracker_hours, 'wall_s': round(wall, 3), 'checks': checks[0],
+                         'checks_per_s': round(checks[0] / wall, 1) if wall else None}
+
+    main.outbox.close(timeout=args.drain_timeout)
+    result['outbox_left'] = main.outbox.depth()
+    started = time.perf_counter()
+    main.store.close()
+    result['shutdown'] = {'save_s': round(time.perf_counter() - started, 3)}
+    result['peak_rss_mb'] = peak_rss_mb()
+    # Сколько запросов к API сделал сам бот: сверяется со счётчиками подставных серверов
+    result['bot_api_calls'] = {game: main.API_SECONDS[game].count() for game in main.GAMES}
+
+    with open(args.worker_output, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# --- управляющий процесс ---
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+
+def run_size(args, tags, workdir):
+    from bench import dataset
+    from bench.fake_servers import FakeGameAPI, FakeTelegramAPI
+
+    started = time.perf_counter()
+    players = dataset.generate(tags, args.days, args.interval, seed=args.seed)
+    data_path = os.path.join(workdir, f'tracked_players.{tags}.json')
+    dataset.save(players, data_path)
+    run = {'tags': tags, 'dataset_mb': round(os.path.getsize(data_path) / 2 ** 20, 1),
+           'dataset_s': round(time.perf_counter() - started, 1)}
+
+    apis = {game: FakeGameAPI(game, players, args.api_latency, args.api_jitter, args.api_429, args.api_errors,
+                              seed=args.seed).start()
+            for game in ('brawlstars', 'clashroyale')}
+    telegram = FakeTelegramAPI(args.telegram_latency, args.telegram_429, seed=args.seed).start()
+    del players
+
+    worker_output = os.path.join(workdir, f'worker.{tags}.json')
+    env = dict(os.environ, TELEGRAM_TOKEN=BENCH_TOKEN, BRAWLSTARS_API_KEY='bench', CLASHROYALE_API_KEY='bench',
+               ADMIN_CHAT_ID=str(ADMIN_CHAT_ID), TRACKED_PLAYERS_FILE=data_path, STORAGE_BACKEND=args.backend,
+               SQLITE_PATH=os.path.join(workdir, f'tracked_players.{tags}.sqlite3'),
+               BRAWLSTARS_API_URL=apis['brawlstars'].api_url, CLASHROYALE_API_URL=apis['clashroyale'].api_url,
+               TELEGRAM_API_URL=telegram.api_url,
+               BRAWLSTARS_RPS=str(args.rps), CLASHROYALE_RPS=str(args.rps))
+    # Без --budget — бюджет по умолчанию из main.py (запрос на тег в час)
+    env.pop('BRAWLSTARS_REQUESTS_PER_HOUR', None)
+    env.pop('CLASHROYALE_REQUESTS_PER_HOUR', None)
+    if args.budget:
+        env.update(BRAWLSTARS_REQUESTS_PER_HOUR=str(args.budget), CLASHROYALE_REQUESTS_PER_HOUR=str(args.budget))
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--worker-output', worker_output,
+               '--seed', str(args.seed), '--concurrency', str(args.concurrency),
+               '--leaderboard-requests', str(args.leaderboard_requests),
+               '--profile-requests', str(args.profile_requests), '--tracker-hours', str(args.tracker_hours),
+               '--drain-timeout', str(args.drain_timeout)]
+    output = None if args.verbose else subprocess.DEVNULL
+    try:
+        completed = subprocess.run(command, cwd=workdir, env=env, stdout=output)
+        if completed.returncode != 0 or not os.path.exists(worker_output):
+            run['error'] = f"процесс бота завершился с кодом {completed.returncode}"
+            return run
+        with open(worker_output, encoding='utf-8') as f:
+            run.update(json.load(f))
+    finally:
+        for api in apis.values():
+            api.stop()
+        telegram.stop()
+
+    calls = run.pop('bot_api_calls', {})
+    run['api'] = {game: {'requests': api.requests, 'calls': calls.get(game), 'throttled': api.throttled,
+                         'errors': api.errors}
+                  for game, api in apis.items()}
+    for game, api in run['api'].items():
+        # Вызовов больше, чем дошло до сервера, — часть ответов отдал кэш внутри клиента API,
+        # и задержки профилей и трекера получились заниженными
+        if api['calls'] is not None and api['calls'] > api['requests']:
+            print(f"Внимание: {game}: бот сделал {api['calls']} запросов, а до API дошло {api['requests']}")
+    run['telegram'] = {'requests': telegram.requests, 'messages': len(telegram.messages),
+                       'throttled': telegram.throttled,
+                       'error_replies': sum(text.startswith(ERROR_MARK) for _, text in telegram.messages)}
+    return run
+
+
+def flatten(data, prefix=''):
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{(old.get('commit') or '?')[:10]} -> {(new.get('commit') or '?')[:10]}")
+    old_runs = {run['tags']: flatten(run) for run in old.get('runs', [])}
+    for run in new.get('runs', []):
+        before, after = old_runs.get(run['tags']), flatten(run)
+        if before is None:
+            continue
+        print(f"\n{run['tags']} тегов:")
+        for metric in KEY_METRICS:
+            if metric in before and metric in after and before[metric]:
+                change = (after[metric] - before[metric]) / before[metric] * 100
+                print(f"  {metric:<22} {before[metric]:>12} -> {after[metric]:>12} ({change:+.1f}%)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота против подставных API")
+    parser.add_argument('--tags', type=int, nargs='+', default=[1000, 10000], help="размеры наборов (1k–100k)")
+    parser.add_argument('--days', type=int, default=90, help="сколько дней истории генерировать")
+    parser.add_argument('--interval', type=float, default=4 * 3600, help="средний шаг точек истории, секунды")
+    parser.add_argument('--backend', default='json', choices=('json', 'sqlite'))
+    parser.add_argument('--api-latency', type=float, default=0.05)
+    parser.add_argument('--api-jitter', type=float, default=0.02)
+    parser.add_argument('--api-429', type=float, default=0.01, help="доля ответов 429 от API игр")
+    parser.add_argument('--api-errors', type=float, default=0.005, help="доля ответов 503 от API игр")
+    parser.add_argument('--telegram-latency', type=float, default=0.01)
+    parser.add_argument('--telegram-429', type=float, default=0.0)
+    parser.add_argument('--rps', type=float, default=200, help="лимит запросов в секунду на API каждой игры")
+    parser.add_argument('--budget', type=float, default=None,
+                        help="бюджет запросов трекера в час на игру (по умолчанию — как в main.py)")
+    parser.add_argument('--concurrency', type=int, default=8, help="одновременных обновлений Telegram")
+    parser.add_argument('--leaderboard-requests', type=int, default=500)
+    parser.add_argument('--profile-requests', type=int, default=500)
+    parser.add_argument('--tracker-hours', type=float, default=1)
+    parser.add_argument('--drain-timeout', type=float, default=30, help="сколько ждать отправки очереди в конце")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="сравнить два файла результатов")
+    parser.add_argument('--verbose', action='store_true', help="показывать вывод бота")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit, dirty = git_revision()
+    results = {'commit': commit, 'dirty': dirty, 'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+               'python': platform.python_version(), 'platform': platform.platform(),
+               'params': {key: value for key, value in vars(args).items()
+                          if key not in ('worker', 'worker_output', 'compare', 'output', 'verbose')},
+               'runs': []}
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        for tags in args.tags:
+            print(f"Прогон на {tags} тегах...")
+            run = run_size(args, tags, workdir)
+            results['runs'].append(run)
+            print(json.dumps(run, ensure_ascii=False))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main_cli()
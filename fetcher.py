@@ -0,0 +1,99 @@
+# === КОНКУРЕНТНАЯ ЗАГРУЗКА ИГРОКОВ ===
+# Трекер раньше ходил в API по одному тегу, и проверка длилась N × время запроса.
+# Здесь запросы идут параллельно (ограниченное число одновременно), каждая игра
+# расходует своё "ведро токенов", а повторы после 429/5xx ставятся в отложенную
+# очередь и не занимают поток, пока ждут своей очереди.
+import heapq
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class TokenBucket:
+    # rate токенов в секунду, не больше capacity подряд (всплеск)
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        # Возвращает 0, если токен взят, иначе сколько секунд подождать
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            time.sleep(delay)
+
+
+class FetchReport:
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self.retries = 0
+        self.elapsed = 0.0
+
+
+def _call(fetch, bucket, key):
+    if bucket is not None:
+        bucket.acquire()
+    return fetch(key)
+
+
+def fetch_many(keys, fetch, bucket=None, max_in_flight=8, is_retryable=None, max_retries=3, base_delay=1.0):
+    # fetch(key) вызывается параллельно, не более max_in_flight одновременно.
+    # Ошибки, для которых is_retryable(e) истинно, повторяются с экспоненциальной
+    # задержкой; остальные (и исчерпавшие попытки) попадают в report.errors.
+    report = FetchReport()
+    started = time.monotonic()
+    pending = deque((key, 0) for key in keys)
+    delayed = []  # куча (когда_можно, порядковый_номер, key, попытка)
+    in_flight = {}
+    seq = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        while pending or delayed or in_flight:
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _, _, key, attempt = heapq.heappop(delayed)
+                pending.append((key, attempt))
+
+            while pending and len(in_flight) < max_in_flight:
+                key, attempt = pending.popleft()
+                in_flight[pool.submit(_call, fetch, bucket, key)] = (key, attempt)
+
+            if not in_flight:
+                time.sleep(max(0.0, delayed[0][0] - now))
+                continue
+
+            timeout = max(0.0, delayed[0][0] - now) if delayed else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, attempt = in_flight.pop(future)
+                try:
+                    report.results[key] = future.result()
+                except Exception as e:
+                    if is_retryable is not None and is_retryable(e) and attempt < max_retries:
+                        delay = base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                        seq += 1
+                        heapq.heappush(delayed, (time.monotonic() + delay, seq, key, attempt + 1))
+                        report.retries += 1
+                    else:
+                        report.errors[key] = e
+
+    report.elapsed = time.monotonic() - started
+    return report
@@ -0,0 +1,254 @@
+# === ИСТОРИЯ КУБКОВ С ПРОРЕЖИВАНИЕМ ===
+# Вместо списка словарей {'timestamp', 'trophies'} на каждую точку история игрока
+# хранится в трёх "ярусах" из параллельных массивов (array):
+#  - raw  — сами точки, последние RAW_KEEP секунд;
+#  - hour — часовые корзины (первое/последнее/мин/макс значение), HOUR_KEEP секунд;
+#  - day  — суточные корзины (UTC), DAY_KEEP секунд.
+# Каждая новая точка сразу попадает во все ярусы, так что ярусы перекрываются, а
+# прореживание просто отрезает у каждого яруса всё старше его срока хранения, кроме
+# последнего элемента до этой границы: он — база для периода длиной в срок хранения
+# (последний элемент не трогается никогда — это текущие кубки).
+#
+# Для периодов не длиннее RAW_KEEP (день) база ищется по сырым точкам — ответ тот же,
+# что и по полной истории. Для более длинных — в самом грубом ярусе, корзина которого
+# не больше 1/24 периода: неделя — по часовым корзинам, месяц и дольше — по суточным.
+# База — последнее значение последней корзины, закончившейся не позже границы.
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+ALL_TIME = math.inf
+
+RAW_KEEP = 2 * 86400
+HOUR_KEEP = 35 * 86400
+DAY_KEEP = 400 * 86400
+
+# (имя, ширина корзины, сколько хранить); ширина 0 — сырые точки
+TIERS = (('raw', 0, RAW_KEEP), ('hour', 3600, HOUR_KEEP), ('day', 86400, DAY_KEEP))
+
+# Чтобы ответ считался точным, корзина должна быть не шире периода / RESOLUTION
+RESOLUTION = 24
+
+
+def tier_for_span(span):
+    # (имя, ширина) яруса для промежутка span — то же правило, что и в History.pick_tier,
+    # но без проверки покрытия (для БД): сырые точки, пока их хватает, дальше самый грубый
+    # достаточно точный ярус
+    if span <= RAW_KEEP:
+        return TIERS[0][:2]
+    for name, width, _ in reversed(TIERS):
+        if width * RESOLUTION <= span:
+            return name, width
+    return TIERS[0][:2]
+
+
+class Tier:
+    __slots__ = ('name', 'width', 'keep', 'start', 'first', 'last', 'low', 'high')
+
+    def __init__(self, name, width, keep):
+        self.name = name
+        self.width = width
+        self.keep = keep
+        self.start = array('q')
+        self.last = array('i')
+        # У сырых точек первое/мин/макс совпадают с самим значением — не храним их
+        self.first = array('i') if width else self.last
+        self.low = array('i') if width else self.last
+        self.high = array('i') if width else self.last
+
+    def __len__(self):
+        return len(self.start)
+
+    def arrays(self):
+        if not self.width:
+            return (self.start, self.last)
+        return (self.start, self.first, self.last, self.low, self.high)
+
+    def add(self, timestamp, trophies):
+        if not self.width:
+            self.start.append(timestamp)
+            self.last.append(trophies)
+            return
+        bucket = timestamp - timestamp % self.width
+        if self.start and self.start[-1] == bucket:
+            self.last[-1] = trophies
+            self.low[-1] = min(self.low[-1], trophies)
+            self.high[-1] = max(self.high[-1], trophies)
+            return
+        for column, value in zip(self.arrays(), (bucket, trophies, trophies, trophies, trophies)):
+            column.append(value)
+
+    def prune_plan(self, now):
+        # Начало первого элемента, который останется после обрезки (или None, если резать нечего).
+        # Последний элемент старше now - keep остаётся: без него база на границе периода длиной
+        # keep нашлась бы только в более грубом ярусе
+        n = min(bisect_left(self.start, now - self.keep) - 1, len(self.start) - 1)
+        return self.start[n] if n > 0 else None
+
+    def prune_to(self, keep_from):
+        n = bisect_left(self.start, keep_from)
+        n = min(n, len(self.start) - 1)
+        if n > 0:
+            for column in self.arrays():
+                del column[:n]
+
+    def covers(self, boundary, origin):
+        # Есть ли в ярусе всё, что нужно для базы на границе boundary
+        if not self.start:
+            return False
+        return self.start[0] <= origin or boundary > self.start[0] + self.width
+
+    def value_before(self, boundary, period_seconds):
+        # (значение, момент, после которого ответ устареет) для последней точки строго до
+        # boundary или последней корзины, закончившейся не позже boundary (все её точки
+        # раньше границы); если такой нет — первое значение яруса
+        if self.width:
+            j = bisect_right(self.start, boundary - self.width)
+        else:
+            j = bisect_left(self.start, boundary)
+        value = self.last[j - 1] if j else self.first[0]
+        expires_at = self.start[j] + self.width + period_seconds if j < len(self.start) else ALL_TIME
+        return value, expires_at
+
+    def copy(self):
+        tier = Tier(self.name, self.width, self.keep)
+        for column, source in zip(tier.arrays(), self.arrays()):
+            column.extend(source)
+        return tier
+
+    def to_json(self):
+        names = ('t', 'v') if not self.width else ('t', 'first', 'last', 'min', 'max')
+        return {name: column.tolist() for name, column in zip(names, self.arrays())}
+
+    def load_json(self, obj):
+        names = ('t', 'v') if not self.width else ('t', 'first', 'last', 'min', 'max')
+        for name, column in zip(names, self.arrays()):
+            column.extend(obj.get(name, []))
+
+
+class History:
+    __slots__ = ('origin', 'raw', 'hour', 'day')
+
+    def __init__(self):
+        self.origin = None  # время самой первой точки за всю жизнь игрока
+        self.raw, self.hour, self.day = (Tier(*tier) for tier in TIERS)
+
+    def tiers(self):
+        return (self.raw, self.hour, self.day)
+
+    def __bool__(self):
+        return bool(self.raw.start)
+
+    def __len__(self):
+        return len(self.raw.start)
+
+    def last(self):
+        return self.raw.last[-1] if self.raw.start else None
+
+    def last_timestamp(self):
+        return self.raw.start[-1] if self.raw.start else None
+
+    def append(self, timestamp, trophies):
+        # Точки принимаются только по возрастанию времени; повтор/старая точка игнорируется
+        if self.raw.start and timestamp <= self.raw.start[-1]:
+            return False
+        if self.origin is None:
+            self.origin = timestamp
+        for tier in self.tiers():
+            tier.add(timestamp, trophies)
+        return True
+
+    def prune_plan(self, now):
+        # {имя яруса: с какого начала оставлять}; пусто — обрезать нечего
+        plan = {}
+        for tier in self.tiers():
+            keep_from = tier.prune_plan(now)
+            if keep_from is not None:
+                plan[tier.name] = keep_from
+        return plan
+
+    def prune_to(self, plan):
+        for tier in self.tiers():
+            if tier.name in plan:
+                tier.prune_to(plan[tier.name])
+
+    def pick_tier(self, span, boundary):
+        # Сырые точки, если они покрывают boundary, иначе самый грубый ярус, который достаточно
+        # точен для промежутка span и покрывает boundary
+        if span <= RAW_KEEP and self.raw.covers(boundary, self.origin):
+            return self.raw
+        for tier in (self.day, self.hour, self.raw):
+            if tier.width * RESOLUTION <= span and tier.covers(boundary, self.origin):
+                return tier
+        # Точного нет — берём тот, где данных больше всего в прошлое
+        for tier in (self.raw, self.hour, self.day):
+            if tier.covers(boundary, self.origin):
+                return tier
+        return self.day if self.day.start else self.raw
+
+    def first_value(self):
+        for tier in (self.day, self.hour, self.raw):
+            if tier.start:
+                return tier.first[0]
+        return None
+
+    def gain(self, period_seconds, now):
+        # (прирост за период, момент, после которого ответ устареет)
+        current = self.last()
+        if period_seconds == ALL_TIME:
+            return current - self.first_value(), ALL_TIME
+        boundary = now - period_seconds
+        value, expires_at = self.pick_tier(period_seconds, boundary).value_before(boundary, period_seconds)
+        return current - value, expires_at
+
+    def series(self, start=None, end=None):
+        # [(время, кубки)] за промежуток из самого грубого подходящего яруса
+        # (для корзин время — начало корзины, кубки — последнее значение в ней)
+        start = self.origin if start is None else start
+        end = (self.last_timestamp() or 0) + 1 if end is None else end
+        if start is None:
+            return []
+        tier = self.pick_tier(end - start, start)
+        i, j = bisect_left(tier.start, start), bisect_left(tier.start, end)
+        return list(zip(tier.start[i:j], tier.last[i:j]))
+
+    def copy(self):
+        # Копия массивов (memcpy) — дёшево, в отличие от сериализации
+        history = History()
+        history.origin = self.origin
+        history.raw, history.hour, history.day = (tier.copy() for tier in self.tiers())
+        return history
+
+    def to_json(self):
+        return {'origin': self.origin, 'raw': self.raw.to_json(), 'hour': self.hour.to_json(),
+                'day': self.day.to_json()}
+
+    @classmethod
+    def from_json(cls, obj):
+        history = cls()
+        if isinstance(obj, list):
+            # Старый формат: список {'timestamp', 'trophies'}
+            for point in sorted(obj, key=lambda p: p['timestamp']):
+                history.append(point['timestamp'], point['trophies'])
+            return history
+        if obj:
+            history.origin = obj.get('origin')
+            for tier in history.tiers():
+                tier.load_json(obj.get(tier.name, {}))
+        return history
+
+    @classmethod
+    def from_rows(cls, origin, raw_rows, bucket_rows):
+        # Сборка из строк БД: raw_rows — [(t, v)], bucket_rows — {ярус: [(t, first, last, min, max)]}
+        history = cls()
+        history.origin = origin
+        for row in raw_rows:
+            for column, value in zip(history.raw.arrays(), row):
+                column.append(value)
+        for tier in (history.hour, history.day):
+            for row in bucket_rows.get(tier.name, []):
+                for column, value in zip(tier.arrays(), row):
+                    column.append(value)
+        if history.origin is None and history:
+            history.origin = min(tier.start[0] for tier in history.tiers() if tier.start)
+        return history
@@ -0,0 +1,109 @@
+# === ИНДЕКС ЛИДЕРБОРДОВ ===
+# Прирост игрока за период = последние кубки минус "базовое" значение: последнее
+# значение истории строго раньше (сейчас - период), а если такого нет — самое
+# первое. Базу ищет сама история (history.py) бинарным поиском по подходящему
+# ярусу. Приросты по каждой паре (игра, период) хранятся готовыми и
+# пересчитываются только для игрока, у которого изменилась история.
+#
+# База зависит от текущего времени: она "переезжает" на следующую точку (корзину),
+# когда та становится старше периода. Момент переезда известен заранее, поэтому
+# для каждой пары (игра, период) держим кучу сроков годности и при запросе
+# пересчитываем только тех игроков, у кого срок истёк.
+import heapq
+import time
+from collections import defaultdict
+
+from history import ALL_TIME
+
+
+class LeaderboardIndex:
+    def __init__(self, store, periods, top_n=10, clock=time.time):
+        self.store = store
+        self.periods = list(periods) + [ALL_TIME]
+        self.top_n = top_n
+        self.clock = clock
+        self._games = {}                          # тег -> игра, под которой он проиндексирован
+        self._gains = defaultdict(dict)           # (игра, период) -> {тег: (прирост, текущие кубки)}
+        self._expires = defaultdict(dict)         # (игра, период) -> {тег: срок годности}
+        self._expiry_heap = defaultdict(list)     # (игра, период) -> куча (срок годности, тег)
+        self._top = {}                            # (игра, период) -> готовый топ или None
+        store.add_listener(self._on_change)
+
+    def rebuild(self):
+        with self.store.view() as players:
+            self._games.clear()
+            self._gains.clear()
+            self._expires.clear()
+            self._expiry_heap.clear()
+            self._top.clear()
+            now = self.clock()
+            for tag in players:
+                self._update(players, tag, now)
+
+    def top(self, game, period_seconds):
+        # Список {'name', 'gain', 'current'} по убыванию прироста, только gain > 0
+        key = (game, period_seconds)
+        with self.store.view() as players:
+            now = self.clock()
+            heap, expires = self._expiry_heap[key], self._expires[key]
+            while heap and heap[0][0] < now:
+                expires_at, tag = heapq.heappop(heap)
+                if expires.get(tag) == expires_at:
+                    self._update_period(players, tag, game, period_seconds, now)
+
+            if self._top.get(key) is None:
+                gains = self._gains[key]
+                self._top[key] = heapq.nlargest(self.top_n, gains, key=lambda t: gains[t][0])
+            return [{'name': players[tag].get('name', tag), 'gain': self._gains[key][tag][0],
+                     'current': self._gains[key][tag][1]} for tag in self._top[key]]
+
+    def _on_change(self, tag):
+        # Вызывается хранилищем под его блокировкой
+        with self.store.view() as players:
+            self._update(players, tag, self.clock())
+
+    def _update(self, players, tag, now):
+        data = players.get(tag)
+        game = data.get('game') if data else None
+        old_game = self._games.get(tag)
+        if old_game is not None and old_game != game:
+            for period_seconds in self.periods:
+                self._set_gain((old_game, period_seconds), tag, None, None)
+        if game is None:
+            self._games.pop(tag, None)
+            return
+        self._games[tag] = game
+        for period_seconds in self.periods:
+            self._update_period(players, tag, game, period_seconds, now)
+
+    def _update_period(self, players, tag, game, period_seconds, now):
+        key = (game, period_seconds)
+        history = players[tag].get('history')
+        if not history:
+            self._set_gain(key, tag, None, None)
+            return
+        gain, expires_at = history.gain(period_seconds, now)
+        self._set_gain(key, tag, (gain, history.last()) if gain > 0 else None, expires_at)
+
+    def _set_gain(self, key, tag, entry, expires_at):
+        gains, expires = self._gains[key], self._expires[key]
+        if expires_at is None or expires_at == ALL_TIME:
+            expires.pop(tag, None)
+        elif expires.get(tag) != expires_at:
+            expires[tag] = expires_at
+            heapq.heappush(self._expiry_heap[key], (expires_at, tag))
+
+        old = gains.get(tag)
+        if entry == old:
+            return
+        if entry is None:
+            del gains[tag]
+        else:
+            gains[tag] = entry
+
+        # Готовый топ сбрасываем, только если изменение может его задеть
+        top = self._top.get(key)
+        if top is None:
+            return
+        if tag in top or (entry is not None and (len(top) < self.top_n or entry[0] >= gains[top[-1]][0])):
+            self._top[key] = None
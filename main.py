@@ -3,12 +3,26 @@ import telebot
 import brawlstats
 import clashroyale
 import os
-import json
+import atexit
+import html
 import re
+import requests
+import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+import fetcher
+import scheduler
+import send_queue
+import stats
+import storage
+import webhook
+from leaderboard import LeaderboardIndex
+from profile_cache import ProfileCache
+from store import PlayerStore
+
 # --- 1. НАСТРОЙКИ ---
 load_dotenv()
 
@@ -35,58 +49,276 @@ if missing_vars:
 # Теперь мы уверены, что ADMIN_CHAT_ID_STR существует
 ADMIN_CHAT_ID = int(ADMIN_CHAT_ID_STR)
 
+# Параметры трекера: сколько запросов одновременно и сколько запросов в секунду на ключ каждой игры
+TRACKER_CONCURRENCY = int(os.getenv('TRACKER_CONCURRENCY', '8'))
+BRAWLSTARS_RPS = float(os.getenv('BRAWLSTARS_RPS', '10'))
+CLASHROYALE_RPS = float(os.getenv('CLASHROYALE_RPS', '10'))
+# Адаптивный опрос: бюджет запросов трекера в час на ключ каждой игры, самый частый и самый
+# редкий интервал проверки одного игрока и шаг тиков (секунды). Без бюджета — не больше, чем
+# раньше: по запросу на отслеживаемый тег в час
+BRAWLSTARS_REQUESTS_PER_HOUR = os.getenv('BRAWLSTARS_REQUESTS_PER_HOUR')
+CLASHROYALE_REQUESTS_PER_HOUR = os.getenv('CLASHROYALE_REQUESTS_PER_HOUR')
+TRACKER_MIN_INTERVAL = int(os.getenv('TRACKER_MIN_INTERVAL', '600'))
+TRACKER_MAX_INTERVAL = int(os.getenv('TRACKER_MAX_INTERVAL', str(6 * 3600)))
+TRACKER_TICK = int(os.getenv('TRACKER_TICK', '60'))
+# Если в одном клубе/клане отслеживается хотя бы столько игроков, их обновляют одним запросом состава
+TRACKER_ROSTER_MIN_GROUP = int(os.getenv('TRACKER_ROSTER_MIN_GROUP', '2'))
+# Кэш профилей: сколько секунд ответ свежий, до какого возраста его можно отдать
+# как устаревший, сколько тегов держать и сколько ждать медленный API
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '60'))
+PROFILE_CACHE_MAX_STALE = float(os.getenv('PROFILE_CACHE_MAX_STALE', '3600'))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '5000'))
+PROFILE_STALE_TIMEOUT = float(os.getenv('PROFILE_STALE_TIMEOUT', '3'))
+# Где хранить игроков: json (tracked_players.json + журнал), sqlite или mongodb
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'tracked_players.sqlite3')
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+MONGODB_DB = os.getenv('MONGODB_DB', 'dolbobotik')
+# По умолчанию бот опрашивает Telegram (worker в Procfile). Режим вебхука включается явно:
+# python main.py --webhook или BOT_MODE=webhook — тогда в Procfile worker заменяется на
+# "web: python main.py --webhook". Процесс должен быть ровно один: polling снимает вебхук,
+# а два трекера и два хранилища дублировали бы запросы и отчёты и писали бы в один файл.
+# WEBHOOK_URL — публичный адрес, который регистрируется в Telegram; если он не задан,
+# вебхук уже должен быть настроен, иначе бот не запустится (обновления бы не приходили).
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or os.getenv('PORT') or '8443')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+# Другие адреса API (нагрузочные тесты в bench/ поднимают локальные подставные серверы)
+BRAWLSTARS_API_URL = os.getenv('BRAWLSTARS_API_URL')
+CLASHROYALE_API_URL = os.getenv('CLASHROYALE_API_URL', 'https://api.clashroyale.com/v1')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # формат telebot: http://host:port/bot{0}/{1}
+
+# Статистика (/stats у админа); если задан STATS_PORT, она же отдаётся в формате Prometheus
+# на http://STATS_HOST:STATS_PORT/metrics (по умолчанию только локально)
+STATS_HOST = os.getenv('STATS_HOST', '127.0.0.1')
+STATS_PORT = int(os.getenv('STATS_PORT') or '0')
+
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
+
 bot = telebot.TeleBot(TELEGRAM_TOKEN, skip_pending=True)
 # ✅ КЛИЕНТ ДЛЯ BRAWL STARS ОСТАЕТСЯ, ТАК КАК ОН РАБОТАЕТ
-cr_client = clashroyale.official_api.Client(token=CLASHROYALE_API_KEY)
-bs_client = brawlstats.Client(BRAWLSTARS_API_KEY, load_brawlers_on_init=False)
+cr_client = clashroyale.official_api.Client(token=CLASHROYALE_API_KEY, url=CLASHROYALE_API_URL)
+bs_client = brawlstats.Client(BRAWLSTARS_API_KEY, load_brawlers_on_init=False, base_url=BRAWLSTARS_API_URL)
+
+
+# У brawlstats свой кэш ответов на 3 минуты. Кэшируем мы сами (ProfileCache), а трекеру нужны
+# свежие кубки, поэтому его обходим: иначе попадание в этот кэш ещё и выглядело бы как
+# очень быстрый запрос в api_request_seconds
+class NoResponseCache(dict):
+    # brawlstats складывает туда каждый ответ даже при use_cache=False — не храним их зря
+    def __setitem__(self, key, value):
+        pass
+
+
+bs_client.cache = NoResponseCache()
+
+
+# brawlstats разбирает только 403/404/429/500/503, а на остальные коды (502, 504, ...)
+# возвращает None и падает уже при сборке модели с ошибкой, по которой не понять, что
+# это сбой сервера. Такие ответы превращаем в requests.HTTPError ещё в сессии
+def raise_for_unhandled_status(response, *args, **kwargs):
+    if response.status_code >= 400 and response.status_code not in (403, 404, 429, 500, 503):
+        response.raise_for_status()
+
+
+bs_client.session.hooks['response'].append(raise_for_unhandled_status)
+
+
+def bs_get_player(tag):
+    return bs_client.get_player(tag, use_cache=False)
+
+
+def bs_get_club_members(club_tag):
+    return bs_client.get_club_members(club_tag, use_cache=False)
+
+
+# У каждого API-ключа свой лимит, поэтому и ведро токенов своё
+API_BUCKETS = {'brawlstars': fetcher.TokenBucket(BRAWLSTARS_RPS), 'clashroyale': fetcher.TokenBucket(CLASHROYALE_RPS)}
+# Повторяем запрос после 429, любого 5xx и сетевых сбоев (см. is_retryable_api_error).
+# Обрыв соединения и тайм-аут brawlstats пропускает наружу как есть
+NETWORK_API_ERRORS = (requests.ConnectionError, requests.Timeout)
+API_THROTTLE_ERRORS = (brawlstats.errors.RateLimitError, clashroyale.RatelimitError)
+API_NOT_FOUND_ERRORS = (brawlstats.errors.NotFoundError, clashroyale.NotFoundError)
+GAMES = ('brawlstars', 'clashroyale')
+metrics = stats.Registry()
 # --- Хранилище и эмодзи ---
-TRACKED_PLAYERS_FILE = 'tracked_players.json'
+TRACKED_PLAYERS_FILE = os.getenv('TRACKED_PLAYERS_FILE', 'tracked_players.json')
 EMOJI = {'trophy': '🏆', 'star': '⭐', 'level': '📊', 'victory': '✅', 'club': '🏰', 'brawler': '🤖', 'error': '❌',
          'info': 'ℹ️', 'card': '🃏', 'crown': '👑', 'chart': '📈'}
 
 
-# --- 2. ФУНКЦИИ ДЛЯ РАБОТЫ С JSON ---
-def load_tracked_players():
+# --- 2. ХРАНИЛИЩЕ ---
+# Загружается один раз при запуске (см. главный запуск), дальше профили и лидерборды
+# читают только память, а запись идёт фоном через выбранный движок (store.py, storage.py)
+def create_storage_backend():
+    if STORAGE_BACKEND == 'sqlite':
+        return storage.SQLiteBackend(SQLITE_PATH)
+    if STORAGE_BACKEND in ('mongodb', 'mongo'):
+        return storage.MongoBackend(MONGODB_URI, MONGODB_DB)
+    if STORAGE_BACKEND != 'json':
+        print(f"!!! Неизвестный STORAGE_BACKEND={STORAGE_BACKEND}, использую json.")
+    return storage.JsonJournalBackend(TRACKED_PLAYERS_FILE)
+
+
+STORE_SECONDS = {operation: metrics.histogram('store_seconds', "Время загрузки и записи хранилища", operation=operation)
+                 for operation in ('load', 'flush', 'snapshot')}
+store = PlayerStore(create_storage_backend(),
+                    observe=lambda operation, seconds: STORE_SECONDS[operation].observe(seconds))
+# Периоды лидербордов; "за всё время" индекс добавляет сам
+LEADERBOARD_PERIODS = {'день': 86400, 'неделя': 7 * 86400, 'месяц': 30 * 86400, 'квартал': 90 * 86400,
+                       'год': 365 * 86400}
+leaderboards = LeaderboardIndex(store, LEADERBOARD_PERIODS.values())
+
+
+def api_error_status(e):
+    # HTTP-код ответа, на котором упал запрос к API игры, или None
+    if isinstance(e, requests.HTTPError):
+        return e.response.status_code if e.response is not None else None
+    if isinstance(e, brawlstats.errors.UnexpectedError):
+        # brawlstats поднимает её только на 500, а code и url в ней перепутаны местами
+        return 500
+    if isinstance(e, (brawlstats.errors.RequestError, clashroyale.RequestError)):
+        # У clashroyale сюда же попадают NotResponding (504) и NetworkError (503)
+        code = getattr(e, 'code', None)
+        return code if isinstance(code, int) else None
+    return None
+
+
+def is_retryable_api_error(e):
+    if isinstance(e, NETWORK_API_ERRORS):
+        return True
+    status = api_error_status(e)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def normalize_tag(raw_tag):
+    tag = raw_tag.strip().upper().replace('O', '0')
+    return tag if tag.startswith('#') else '#' + tag
+
+
+def club_tag_of(player):
+    # Клуб (BS) или клан (CR) игрока, None — если не состоит
+    club = getattr(player, 'club', None) or getattr(player, 'clan', None)
+    return club.tag if club else None
+
+
+API_SECONDS = {game: metrics.histogram('api_request_seconds', "Время запроса к API игры", game=game) for game in GAMES}
+API_ERRORS = {game: metrics.counter('api_errors_total', "Ошибки запросов к API игры, кроме 429 и 404", game=game)
+              for game in GAMES}
+API_THROTTLED = {game: metrics.counter('api_throttled_total', "Ответы 429 от API игры", game=game) for game in GAMES}
+
+
+def instrumented_api_call(game, call):
+    # Время, ошибки и 429 каждого запроса к API игры (для /stats)
+    def timed_call(*args):
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        except API_NOT_FOUND_ERRORS:
+            raise  # опечатка в теге — не сбой API
+        except API_THROTTLE_ERRORS:
+            API_THROTTLED[game].inc()
+            raise
+        except Exception:
+            API_ERRORS[game].inc()
+            raise
+        finally:
+            API_SECONDS[game].observe(time.perf_counter() - started)
+    return timed_call
+
+
+def make_player_getter(game, fetch):
+    get = instrumented_api_call(game, fetch)
+
+    def get_player(tag):
+        API_BUCKETS[game].acquire()
+        return get(tag)
+    return get_player
+
+
+# Один кэш на игру; трекер тоже складывает сюда всё, что скачал
+profile_caches = {game: ProfileCache(make_player_getter(game, fetch), PROFILE_CACHE_TTL, PROFILE_CACHE_MAX_STALE,
+                                     PROFILE_CACHE_SIZE, PROFILE_STALE_TIMEOUT, is_retryable_api_error)
+                  for game, fetch in (('brawlstars', bs_get_player), ('clashroyale', cr_client.get_player))}
+STALE_NOTE = f"\n\n<i>{EMOJI['info']} API игры сейчас не отвечает, показаны недавние сохранённые данные.</i>"
+for game in GAMES:
+    metrics.callback('profile_cache_hit_rate', "Доля ответов из кэша профилей",
+                     lambda cache=profile_caches[game]: cache.stats()['hit_rate'], game=game)
+
+
+# --- 3. ОТПРАВКА СООБЩЕНИЙ ---
+# Все ответы идут через общую очередь (send_queue.py): обработчики не ждут Telegram,
+# длинные отчёты режутся на куски, а на 429 очередь сама выжидает retry_after
+def telegram_retry_after(e):
+    if isinstance(e, telebot.apihelper.ApiTelegramException) and e.error_code == 429:
+        return (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+    return None
+
+
+outbox = send_queue.OutboundQueue(bot.send_message, telegram_retry_after)
+metrics.callback('outbox_depth', "Сообщений в очереди отправки", outbox.depth)
+metrics.callback('outbox_sent_total', "Отправлено сообщений", lambda: outbox.sent, kind='counter')
+metrics.callback('outbox_failed_total', "Не удалось отправить сообщений", lambda: outbox.failed, kind='counter')
+metrics.callback('outbox_merged_total', "Сообщений склеено с соседними", lambda: outbox.merged, kind='counter')
+
+
+def reply_to(message, text, **kwargs):
+    outbox.send(message.chat.id, text, reply_parameters=telebot.types.ReplyParameters(message.message_id), **kwargs)
+
+
+# "Печатает..." — только украшение: запрос уходит фоном, чтобы обработчик его не ждал,
+# а 429 или сбой сети здесь не мешают ответу. Если Telegram тормозит и индикаторы
+# копятся, новые просто пропускаются
+typing_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='typing')
+typing_slots = threading.BoundedSemaphore(16)
+
+
+def send_typing(chat_id):
     try:
-        with open(TRACKED_PLAYERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        save_tracked_players({})
-        return {}
+        bot.send_chat_action(chat_id, 'typing')
+    except Exception as e:
+        print(f"Не удалось показать набор текста в чате {chat_id}: {e}")
+    finally:
+        typing_slots.release()
 
 
-def save_tracked_players(players_data):
-    with open(TRACKED_PLAYERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(players_data, f, indent=4, ensure_ascii=False)
+def show_typing(chat_id):
+    if typing_slots.acquire(blocking=False):
+        typing_pool.submit(send_typing, chat_id)
 
 
-# --- 3. ОБРАБОТЧИКИ КОМАНД ---
+# --- 4. ОБРАБОТЧИКИ КОМАНД ---
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
-    bot.send_message(message.chat.id, f"👋 Привет, {message.from_user.first_name}!\n\n"
-                                      f"Я бот для игровой статистики. Чтобы узнать профиль, введите команду и тег, например:\n\n"
-                                      f"• <code>/profilebs #TAG</code>\n"
-                                      f"• <code>/profilecr #TAG</code>\n\n"
-                                      f"<b>Лидерборды:</b>\n"
-                                      f"• <code>бс лидер [день/неделя]</code>\n"
-                                      f"• <code>клэш лидер [день/неделя]</code>", parse_mode='HTML')
+    outbox.send(message.chat.id, f"👋 Привет, {message.from_user.first_name}!\n\n"
+                                 f"Я бот для игровой статистики. Чтобы узнать профиль, введите команду и тег, например:\n\n"
+                                 f"• <code>/profilebs #TAG</code>\n"
+                                 f"• <code>/profilecr #TAG</code>\n\n"
+                                 f"<b>Лидерборды:</b>\n"
+                                 f"• <code>бс лидер [день/неделя/месяц/квартал/год]</code>\n"
+                                 f"• <code>клэш лидер [день/неделя/месяц/квартал/год]</code>", parse_mode='HTML')
 
 
 # --- Логика Brawl Stars (без изменений) ---
 @bot.message_handler(commands=['profilebs'])
+@stats.timed(metrics.histogram('handler_seconds', "Время обработки команды", handler='send_bs_profile'))
 def send_bs_profile(message):
     try:
         parts = message.text.split()
         if len(parts) < 2:
-            bot.reply_to(message, "Пожалуйста, укажите тег после команды.\nПример: `/profilebs #2G98QY98`",
-                         parse_mode='Markdown')
+            reply_to(message, "Пожалуйста, укажите тег после команды.\nПример: `/profilebs #2G98QY98`",
+                     parse_mode='Markdown')
             return
-        tag = parts[1].strip().upper().replace('O', '0')
-        if not tag.startswith('#'): tag = '#' + tag
+        tag = normalize_tag(parts[1])
 
-        bot.send_chat_action(message.chat.id, 'typing')
-        player = bs_client.get_player(tag)  # Используем старый, рабочий клиент
+        show_typing(message.chat.id)
+        player, is_stale = profile_caches['brawlstars'].get(tag)  # Используем старый, рабочий клиент (через кэш)
 
         # ... (остальной код для BS без изменений)
         club_info = f"{player.club.name} ({player.club.tag})" if player.club else "Не состоит"
@@ -100,47 +332,43 @@ def send_bs_profile(message):
             f"<b>{EMOJI['trophy']} Трофеи:</b> {player.trophies}\n<b>{EMOJI['star']} Рекорд:</b> {player.highest_trophies}\n<b>{EMOJI['level']} Уровень:</b> {player.exp_level}\n\n"
             f"<b>{EMOJI['victory']} Победы 3v3:</b> {player.x3v3_victories}\n<b>{EMOJI['victory']} Solo/Duo:</b> {player.solo_victories} / {player.duo_victories}\n\n"
             f"<b>{EMOJI['club']} Клуб:</b> {club_info}\n\n<b>Топ-5 бравлеров:</b>\n{brawlers_text}")
-        bot.send_message(message.chat.id, response, parse_mode='HTML')
+        if is_stale: response += STALE_NOTE
+        outbox.send(message.chat.id, response, parse_mode='HTML')
 
         # Добавляем в отслеживание
-        tracked_players = load_tracked_players()
-        if tag not in tracked_players:
-            tracked_players[tag] = {'name': player.name, 'game': 'brawlstars',
-                                    'history': [{'timestamp': int(time.time()), 'trophies': player.trophies}]}
-            bot.send_message(message.chat.id, f"✅ Игрок <b>{player.name}</b> (Brawl Stars) добавлен в отслеживание.",
-                             parse_mode='HTML')
-        else:
-            tracked_players[tag].update({'name': player.name, 'game': 'brawlstars'})
-        save_tracked_players(tracked_players)
+        if store.upsert_player(tag, player.name, 'brawlstars', player.trophies):
+            outbox.send(message.chat.id, f"✅ Игрок <b>{player.name}</b> (Brawl Stars) добавлен в отслеживание.",
+                        parse_mode='HTML')
+        store.set_club(tag, club_tag_of(player))
 
     except brawlstats.errors.NotFoundError:
-        bot.reply_to(message, f"{EMOJI['error']} Игрок Brawl Stars с тегом <code>{tag}</code> не найден.",
-                     parse_mode='HTML')
+        reply_to(message, f"{EMOJI['error']} Игрок Brawl Stars с тегом <code>{tag}</code> не найден.",
+                 parse_mode='HTML')
     except Exception as e:
-        bot.reply_to(message, f"{EMOJI['error']} Ошибка: {e}")
+        reply_to(message, f"{EMOJI['error']} Ошибка: {e}")
 
     except brawlstats.errors.NotFoundError:
-        bot.reply_to(message, f"{EMOJI['error']} Игрок Brawl Stars с тегом <code>{tag}</code> не найден.",
-                     parse_mode='HTML')
+        reply_to(message, f"{EMOJI['error']} Игрок Brawl Stars с тегом <code>{tag}</code> не найден.",
+                 parse_mode='HTML')
     except Exception as e:
-        bot.reply_to(message, f"{EMOJI['error']} Произошла непредвиденная ошибка: {e}")
+        reply_to(message, f"{EMOJI['error']} Произошла непредвиденная ошибка: {e}")
 
 
 # --- Логика Clash Royale (полностью переписана под правильную библиотеку) ---
 @bot.message_handler(commands=['profilecr'])
+@stats.timed(metrics.histogram('handler_seconds', "Время обработки команды", handler='send_cr_profile'))
 def send_cr_profile(message):
     try:
         parts = message.text.split()
         if len(parts) < 2:
-            bot.reply_to(message, "Пример: `/profilecr #8L9L9GL`", parse_mode='Markdown')
+            reply_to(message, "Пример: `/profilecr #8L9L9GL`", parse_mode='Markdown')
             return
-        tag = parts[1].strip().upper().replace('O', '0')
-        if not tag.startswith('#'): tag = '#' + tag        
-        bot.send_chat_action(message.chat.id, 'typing')
+        tag = normalize_tag(parts[1])
+        show_typing(message.chat.id)
         
         # ✅✅✅ ПРАВИЛЬНЫЙ ВЫЗОВ СОГЛАСНО ДОКУМЕНТАЦИИ ✅✅✅
-        # Мы просто вызываем функцию из модуля, передавая токен каждый раз.
-        player = cr_client.get_player(tag)
+        # Запрос идёт через кэш: одинаковые теги из разных чатов не дублируются.
+        player, is_stale = profile_caches['clashroyale'].get(tag)
         club_info = f"{player.clan.name} ({player.clan.tag})" if player.clan else "Не состоит"
         current_deck = ", ".join([card.name for card in player.current_deck])
 
@@ -148,27 +376,25 @@ def send_cr_profile(message):
                     f"<b>{EMOJI['trophy']} Трофеи:</b> {player.trophies}\n<b>{EMOJI['star']} Рекорд:</b> {player.best_trophies}\n<b>{EMOJI['level']} Уровень:</b> {player.exp_level}\n\n"
                     f"<b>{EMOJI['victory']} Победы/Поражения:</b> {player.wins} / {player.losses}\n\n"
                     f"<b>{EMOJI['club']} Клан:</b> {club_info}\n\n<b>{EMOJI['card']} Текущая колода:</b>\n<pre>{current_deck}</pre>")
-        bot.send_message(message.chat.id, response, parse_mode='HTML')
+        if is_stale: response += STALE_NOTE
+        outbox.send(message.chat.id, response, parse_mode='HTML')
 
         # Добавляем в отслеживание
-        tracked_players = load_tracked_players()
-        if tag not in tracked_players:
-            tracked_players[tag] = {'name': player.name, 'game': 'clashroyale', 'history': [{'timestamp': int(time.time()), 'trophies': player.trophies}]}
-            bot.send_message(message.chat.id, f"✅ Игрок <b>{player.name}</b> (Clash Royale) добавлен в отслеживание.", parse_mode='HTML')
-        else:
-            tracked_players[tag].update({'name': player.name, 'game': 'clashroyale'})
-        save_tracked_players(tracked_players)
+        if store.upsert_player(tag, player.name, 'clashroyale', player.trophies):
+            outbox.send(message.chat.id, f"✅ Игрок <b>{player.name}</b> (Clash Royale) добавлен в отслеживание.", parse_mode='HTML')
+        store.set_club(tag, club_tag_of(player))
 
     except clashroyale.NotFoundError:
-        bot.reply_to(message, f"{EMOJI['error']} Игрок Clash Royale с тегом <code>{tag}</code> не найден.", parse_mode='HTML')
+        reply_to(message, f"{EMOJI['error']} Игрок Clash Royale с тегом <code>{tag}</code> не найден.", parse_mode='HTML')
     except clashroyale.RequestError as e:
-        bot.reply_to(message, f"{EMOJI['error']} Ошибка API Clash Royale: {e}")
+        reply_to(message, f"{EMOJI['error']} Ошибка API Clash Royale: {e}")
     except Exception as e:
-        bot.reply_to(message, f"{EMOJI['error']} Произошла непредвиденная ошибка: {e}")
+        reply_to(message, f"{EMOJI['error']} Произошла непредвиденная ошибка: {e}")
 
 # --- ✅ ВОЗВРАЩАЕМ ЛИДЕРБОРДЫ ---
 @bot.message_handler(
     func=lambda msg: msg.text and msg.text.lower().startswith(('бс лидер', 'клэш лидер', 'клеш лидер')))
+@stats.timed(metrics.histogram('handler_seconds', "Время обработки команды", handler='leaderboard_handler'))
 def leaderboard_handler(message):
     text = message.text.lower()
 
@@ -179,10 +405,8 @@ def leaderboard_handler(message):
         game, game_name = 'clashroyale', 'Clash Royale'
         period_name = text.replace('клэш лидер', '').replace('клеш лидер', '').strip()
 
-    periods = {'день': 86400, 'неделя': 7 * 86400, 'месяц': 30 * 86400}
-
-    if period_name in periods:
-        title, period_seconds = f"за {period_name}", periods[period_name]
+    if period_name in LEADERBOARD_PERIODS:
+        title, period_seconds = f"за {period_name}", LEADERBOARD_PERIODS[period_name]
     else:
         title, period_seconds = "за всё время", float('inf')
 
@@ -190,119 +414,266 @@ def leaderboard_handler(message):
 
 
 def send_leaderboard(chat_id, period_seconds, title, game, game_name):
-    bot.send_chat_action(chat_id, 'typing')
-    players_data = load_tracked_players()
-    now = int(time.time())
-    start_boundary = now - period_seconds
-    leaderboard = []
-
-    for tag, data in players_data.items():
-        if data.get('game') != game:
-            continue
-        history = data.get('history', [])
-        if not history: continue
-
-        start_trophies = history[0]['trophies']
-        if period_seconds != float('inf'):
-            relevant_points = [p['trophies'] for p in history if p['timestamp'] < start_boundary]
-            if relevant_points: start_trophies = relevant_points[-1]
+    show_typing(chat_id)
+    # Топ уже посчитан индексом (leaderboard.py), здесь только оформление
+    sorted_leaderboard = leaderboards.top(game, period_seconds)
 
-        gain = history[-1]['trophies'] - start_trophies
-        if gain > 0:
-            leaderboard.append({'name': data.get('name', tag), 'gain': gain, 'current': history[-1]['trophies']})
-
-    if not leaderboard:
-        bot.send_message(chat_id, f"Никто не набил кубки в {game_name} {title}.")
+    if not sorted_leaderboard:
+        outbox.send(chat_id, f"Никто не набил кубки в {game_name} {title}.")
         return
 
-    sorted_leaderboard = sorted(leaderboard, key=lambda x: x['gain'], reverse=True)[:10]
     response_lines = [f"{EMOJI['crown']} <b>Лидерборд {game_name.upper()} {title.upper()}</b> {EMOJI['crown']}\n"]
     for i, player in enumerate(sorted_leaderboard):
         place_emoji = {0: '🥇', 1: '🥈', 2: '🥉'}.get(i, f' {i + 1}.')
         response_lines.append(
             f"{place_emoji} <b>{player['name']}</b>: +{player['gain']} {EMOJI['trophy']} (всего: {player['current']})")
 
-    bot.send_message(chat_id, "\n".join(response_lines), parse_mode='HTML')
+    outbox.send(chat_id, "\n".join(response_lines), parse_mode='HTML')
+
+
+# --- СТАТИСТИКА ДЛЯ АДМИНА ---
+@bot.message_handler(commands=['stats'])
+def send_stats(message):
+    # Только для ADMIN_CHAT_ID, остальным команда не отвечает
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+    outbox.send(message.chat.id, f"{EMOJI['chart']} <b>Статистика</b>\n<pre>{html.escape(metrics.render_text())}</pre>",
+                parse_mode='HTML')
 
 
 # --- ✅ ВОЗВРАЩАЕМ ЕЖЕЧАСОВЫЙ ТРЕКЕР ---
-def hourly_tracker():
-    print("🚀 Мульти-игровой трекер запущен.")
-    while True:
-        time.sleep(3600)
+# Состав клуба BS и клана CR приходит одним ответом вместе с кубками всех участников
+PLAYER_GETTERS = {'brawlstars': instrumented_api_call('brawlstars', bs_get_player),
+                  'clashroyale': instrumented_api_call('clashroyale', cr_client.get_player)}
+ROSTER_GETTERS = {'brawlstars': instrumented_api_call('brawlstars', bs_get_club_members),
+                  'clashroyale': instrumented_api_call('clashroyale',
+                                                       lambda clan_tag: cr_client.get_clan(clan_tag).member_list)}
+
+
+def fetch_tracked_players(jobs_by_game):
+    # Задания вида ('player', тег игрока) или ('roster', тег клуба). Обе игры качаем
+    # одновременно: у каждой свой клиент и своё ведро токенов
+    def make_fetch(game):
+        def fetch(job):
+            kind, tag = job
+            return (PLAYER_GETTERS if kind == 'player' else ROSTER_GETTERS)[game](tag)
+        return fetch
+
+    with ThreadPoolExecutor(max_workers=len(jobs_by_game) or 1) as pool:
+        futures = {game: pool.submit(fetcher.fetch_many, jobs, make_fetch(game), API_BUCKETS[game],
+                                     TRACKER_CONCURRENCY, is_retryable_api_error)
+                   for game, jobs in jobs_by_game.items()}
+        return {game: future.result() for game, future in futures.items()}
+
+
+# У каждого тега своё время следующей проверки (scheduler.py); активных игроков
+# проверяем чаще, неактивных реже, в пределах бюджета запросов каждой игры
+tracker_clock = scheduler.SystemClock()
+poll_schedulers = {
+    game: scheduler.PollScheduler(float(budget) if budget else None, TRACKER_MIN_INTERVAL, TRACKER_MAX_INTERVAL,
+                                  TRACKER_TICK)
+    for game, budget in (('brawlstars', BRAWLSTARS_REQUESTS_PER_HOUR), ('clashroyale', CLASHROYALE_REQUESTS_PER_HOUR))}
+# Изменения за текущий час для отчёта: игра -> {тег: [имя, кубки в начале часа, текущие кубки]}
+hourly_changes = {game: {} for game in poll_schedulers}
+GAME_TITLES = {'brawlstars': ('BS', 'BRAWL STARS'), 'clashroyale': ('CR', 'CLASH ROYALE')}
+TRACKER_TICK_SECONDS = metrics.histogram('tracker_tick_seconds', "Длительность тика трекера с проверками")
+TRACKER_CHECKS = {game: metrics.counter('tracker_checks_total', "Проверено тегов трекером", game=game)
+                  for game in GAMES}
+metrics.callback('tracker_tags_per_second', "Тегов в секунду за время работы тиков",
+                 lambda: sum(c.value() for c in TRACKER_CHECKS.values()) / (TRACKER_TICK_SECONDS.sum() or 1))
+
+
+def record_check(game, tag, name, trophies, now):
+    TRACKER_CHECKS[game].inc()
+    changed = False
+    try:
+        last_trophies = store.last_trophies(tag)
+        store.upsert_player(tag, name, game)
+        if trophies != last_trophies:
+            store.append_point(tag, now, trophies)
+            changed = last_trophies is not None
+        if last_trophies is not None:
+            entry = hourly_changes[game].setdefault(tag, [name, last_trophies, last_trophies])
+            entry[0], entry[2] = name, trophies
+        store.prune_history(tag, now)
+    except Exception as e:
+        print(f"Ошибка при проверке тега {tag} ({game}): {e}")
+    poll_schedulers[game].reschedule(tag, changed, now)
+
+
+def plan_tracker_jobs(game, due):
+    # Игроков из клубов, где отслеживается несколько человек, обновляем составом клуба,
+    # остальных — по одному. Возвращает задания и {клуб: теги из due, ждущие этот состав}.
+    clubs = store.clubs(game)
+    club_sizes = {}
+    for club in clubs.values():
+        club_sizes[club] = club_sizes.get(club, 0) + 1
+
+    jobs, waiting = [], {}
+    for tag in due:
+        club = clubs.get(tag)
+        if club and club_sizes[club] >= TRACKER_ROSTER_MIN_GROUP:
+            if club not in waiting:
+                waiting[club] = []
+                jobs.append(('roster', club))
+            waiting[club].append(tag)
+        else:
+            jobs.append(('player', tag))
+    return jobs, waiting
 
-        print(f"[{time.ctime()}] Начинаю ежечасную проверку кубков...")
-        tracked_players = load_tracked_players()
-        if not tracked_players:
-            print("Список отслеживания пуст.")
+
+def apply_tracker_results(game, report, waiting, now):
+    # Возвращает теги, которых не оказалось в составе своего клуба (ушли или состав не загрузился)
+    fallback = []
+    tracked = set(store.tags(game)) if any(kind == 'roster' for kind, _ in report.results) else set()
+    for (kind, tag), e in report.errors.items():
+        if kind == 'roster':
+            fallback.extend(waiting[tag])
+        else:
+            print(f"Ошибка при проверке тега {tag} ({game}): {e}")
+            poll_schedulers[game].reschedule(tag, False, now)
+
+    for (kind, tag), result in report.results.items():
+        if kind == 'player':
+            profile_caches[game].put(tag, result)
+            store.set_club(tag, club_tag_of(result))
+            record_check(game, tag, result.name, result.trophies, now)
             continue
+        # Состав клуба обновляет сразу всех отслеживаемых участников, а не только тех, чей срок подошёл
+        members = {member.tag: member for member in result}
+        for member_tag, member in members.items():
+            if member_tag in tracked:
+                store.set_club(member_tag, tag)
+                record_check(game, member_tag, member.name, member.trophies, now)
+        fallback.extend(t for t in waiting[tag] if t not in members)
+    return fallback
+
+
+def tracker_tick(now):
+    # Один тик трекера: проверяет все теги, которым подошёл срок. Возвращает их число.
+    now = int(now)
+    jobs_by_game, waiting_by_game, due_count = {}, {}, 0
+    for game, game_scheduler in poll_schedulers.items():
+        game_scheduler.sync(store.tags(game), now)
+        due = game_scheduler.pop_due(now)
+        if due:
+            jobs_by_game[game], waiting_by_game[game] = plan_tracker_jobs(game, due)
+            due_count += len(due)
+    if not jobs_by_game:
+        return 0
+
+    reports = fetch_tracked_players(jobs_by_game)
+    fallback_jobs = {}
+    for game, report in reports.items():
+        fallback = apply_tracker_results(game, report, waiting_by_game[game], now)
+        if fallback:
+            fallback_jobs[game] = [('player', tag) for tag in fallback]
+        print(f"[{time.ctime(now)}] {game}: запросов {len(jobs_by_game[game])}, успешно {len(report.results)} "
+              f"за {report.elapsed:.1f} с (повторов: {report.retries}, без клуба в составе: {len(fallback)}).")
+
+    # Сменившие клуб или чей состав не загрузился — по одному, как раньше
+    if fallback_jobs:
+        for game, report in fetch_tracked_players(fallback_jobs).items():
+            apply_tracker_results(game, report, {}, now)
+    return due_count
+
+
+def send_hourly_reports():
+    for game, changes in hourly_changes.items():
+        short_name, title = GAME_TITLES[game]
+        lines = [f" • <b>{name}</b>: +{current - start} {EMOJI['trophy']} (стало {current})"
+                 for name, start, current in changes.values() if current > start]
+        changes.clear()
+        print(f"{game}: кэш профилей {profile_caches[game].stats()}, "
+              f"тегов в расписании {len(poll_schedulers[game])}, растяжение {poll_schedulers[game].stretch():.2f}")
+        if lines:
+            header = f"{EMOJI['chart']} <b>Ежечасный отчет {title}:</b>\n\n"
+            outbox.send(ADMIN_CHAT_ID, header + "\n".join(lines), parse_mode='HTML')
+            print(f"Отчет об изменениях в {short_name} поставлен в очередь отправки.")
+
+
+def hourly_tracker(until=None):
+    # until — момент остановки по часам трекера (для прогонов на SimulatedClock), None — без конца
+    print("🚀 Мульти-игровой трекер запущен.")
+    now = tracker_clock.now()
+    report_hour = now // 3600
+    while until is None or now < until:
+        # Тики выровнены по часам, поэтому длительность проверки не сдвигает расписание
+        now = tracker_clock.sleep_until((now // TRACKER_TICK + 1) * TRACKER_TICK)
+        started = time.perf_counter()
+        try:
+            if tracker_tick(now):
+                TRACKER_TICK_SECONDS.observe(time.perf_counter() - started)
+        except Exception as e:
+            print(f"Ошибка трекера: {e}")
+
+        if now // 3600 != report_hour:
+            report_hour = now // 3600
+            send_hourly_reports()
+
+
+# --- 5. ГЛАВНЫЙ ЗАПУСК ---
+def handle_webhook_update(data):
+    bot.process_new_updates([telebot.types.Update.de_json(data)])
+
+
+def run_webhook():
+    # Обработчики выполняются прямо в потоках пула вебхука, без собственного пула telebot
+    bot.threaded = False
+    dispatcher = webhook.UpdateDispatcher(handle_webhook_update, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    dispatcher.start()
+    metrics.callback('webhook_queue_depth', "Обновлений в очередях вебхука", dispatcher.queue_depth)
+    metrics.callback('webhook_dropped_total', "Обновлений отброшено из-за переполнения",
+                     lambda: dispatcher.dropped, kind='counter')
+    server = webhook.make_server(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, dispatcher, WEBHOOK_SECRET)
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    print(f"✅ Бот (ПОЛНАЯ ВЕРСИЯ BS + CR) запущен в режиме вебхука на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    server.serve_forever()
+
+
+def webhook_mode():
+    return '--webhook' in sys.argv or os.getenv('BOT_MODE') == 'webhook'
+
+
+def check_webhook_registered():
+    # Без WEBHOOK_URL бот сам вебхук не ставит, а polling при прошлом запуске его снял
+    if WEBHOOK_URL:
+        return
+    if not bot.get_webhook_info().url:
+        print("❌ Режим вебхука: WEBHOOK_URL не задан и вебхук в Telegram не зарегистрирован. "
+              "Задайте WEBHOOK_URL или запускайте бота без --webhook / BOT_MODE=webhook.")
+        sys.exit(1)
+
 
-        now = int(time.time())
-        month_ago = now - 31 * 86400
-        bs_changes_report = []
-        cr_changes_report = []
-
-        for tag, data in tracked_players.items():
-            try:
-                game_type = data.get('game')
-                history = data.get('history', [])
-                if not history: continue
-
-                trophy_change = 0
-                current_trophies = 0
-                current_name = data.get('name', tag)
-
-                if game_type == 'brawlstars':
-                    player = bs_client.get_player(tag)
-                    current_trophies = player.trophies
-                    current_name = player.name
-                    trophy_change = current_trophies - history[-1]['trophies']
-                    if trophy_change > 0:
-                        bs_changes_report.append(
-                            f" • <b>{current_name}</b>: +{trophy_change} {EMOJI['trophy']} (стало {current_trophies})")
-                elif game_type == 'clashroyale':
-                    player = cr_client.get_player(tag)
-                    current_trophies = player.trophies
-                    current_name = player.name
-                    trophy_change = current_trophies - history[-1]['trophies']
-                    if trophy_change > 0:
-                        cr_changes_report.append(
-                            f" • <b>{current_name}</b>: +{trophy_change} {EMOJI['trophy']} (стало {current_trophies})")
-                else:
-                    continue
-
-                data['name'] = current_name
-                if not history or history[-1].get('trophies') != current_trophies:
-                    data['history'].append({'timestamp': now, 'trophies': current_trophies})
-                data['history'] = [p for p in data['history'] if p['timestamp'] > month_ago]
-
-            except Exception as e:
-                print(f"Ошибка при проверке тега {tag} ({data.get('game')}): {e}")
-
-        if bs_changes_report:
-            header = f"{EMOJI['chart']} <b>Ежечасный отчет BRAWL STARS:</b>\n\n"
-            full_report = header + "\n".join(bs_changes_report)
-            bot.send_message(ADMIN_CHAT_ID, full_report, parse_mode='HTML')
-            print("Отчет об изменениях в BS отправлен.")
-
-        if cr_changes_report:
-            header = f"{EMOJI['chart']} <b>Ежечасный отчет CLASH ROYALE:</b>\n\n"
-            full_report = header + "\n".join(cr_changes_report)
-            bot.send_message(ADMIN_CHAT_ID, full_report, parse_mode='HTML')
-            print("Отчет об изменениях в CR отправлен.")
-
-        save_tracked_players(tracked_players)
-        print("Проверка завершена.")
-
-
-# --- 4. ГЛАВНЫЙ ЗАПУСК ---
 if __name__ == '__main__':
     # Удаляем старый файл, если он есть, т.к. структура могла измениться
     # if os.path.exists(TRACKED_PLAYERS_FILE):
     #     os.remove(TRACKED_PLAYERS_FILE)
 
+    if webhook_mode():
+        check_webhook_registered()
+    if not store.backend.snapshots:
+        storage.migrate_from_json(store.backend, TRACKED_PLAYERS_FILE)
+    store.load()
+    leaderboards.rebuild()
+    store.start()
+    atexit.register(store.close)
+    outbox.start()
+    atexit.register(outbox.close)
+    if STATS_PORT:
+        stats_server = stats.make_server(STATS_HOST, STATS_PORT, metrics)
+        threading.Thread(target=stats_server.serve_forever, daemon=True).start()
+        print(f"Статистика Prometheus: http://{STATS_HOST}:{STATS_PORT}/metrics")
+
     tracker_thread = threading.Thread(target=hourly_tracker, daemon=True)
     tracker_thread.start()
 
-    print("✅ Бот (ПОЛНАЯ ВЕРСИЯ BS + CR) запущен!")
-    bot.infinity_polling(timeout=30)
+    if webhook_mode():
+        run_webhook()
+    else:
+        # Если раньше был включён вебхук, getUpdates с ним не работает
+        bot.remove_webhook()
+        print("✅ Бот (ПОЛНАЯ ВЕРСИЯ BS + CR) запущен!")
+        bot.infinity_polling(timeout=30)
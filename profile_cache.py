@@ -0,0 +1,94 @@
+# === КЭШ ПРОФИЛЕЙ ===
+# Ответы API по игрокам (ключ — нормализованный тег) живут ttl секунд. Если
+# несколько чатов одновременно спрашивают один и тот же тег, в API уходит один
+# запрос, остальные ждут его результат. Если API тормозит или отвечает 429/5xx,
+# а в кэше есть не слишком старый ответ (моложе max_stale), отдаём его с пометкой
+# "устарело", а запрос продолжает выполняться в фоне и обновит кэш.
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+
+class ProfileCache:
+    def __init__(self, fetch, ttl=60, max_stale=3600, maxsize=5000, stale_timeout=3.0,
+                 is_retryable=None, workers=8, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.maxsize = maxsize
+        self.stale_timeout = stale_timeout
+        self.is_retryable = is_retryable or (lambda e: False)
+        self.clock = clock
+        self._entries = OrderedDict()  # тег -> (когда получен, объект игрока)
+        self._in_flight = {}           # тег -> Future текущего запроса
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.coalesced = 0
+
+    def get(self, tag):
+        # Возвращает (игрок, устарел_ли)
+        with self._lock:
+            entry = self._entries.get(tag)
+            if entry is not None:
+                self._entries.move_to_end(tag)
+                age = self.clock() - entry[0]
+                if age < self.ttl:
+                    self.hits += 1
+                    return entry[1], False
+                if age >= self.max_stale:
+                    entry = None
+            self.misses += 1
+            future = self._in_flight.get(tag)
+            if future is None:
+                future = Future()
+                self._in_flight[tag] = future
+                self._pool.submit(self._load, tag, future)
+            else:
+                self.coalesced += 1
+
+        if entry is None:
+            return future.result(), False
+
+        try:
+            return future.result(timeout=self.stale_timeout), False
+        except TimeoutError:
+            pass
+        except Exception as e:
+            if not self.is_retryable(e):
+                raise
+        with self._lock:
+            self.stale += 1
+        return entry[1], True
+
+    def put(self, tag, player):
+        with self._lock:
+            self._store(tag, player)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'stale': self.stale,
+                    'coalesced': self.coalesced, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def _store(self, tag, player):
+        self._entries[tag] = (self.clock(), player)
+        self._entries.move_to_end(tag)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _load(self, tag, future):
+        try:
+            player = self.fetch(tag)
+        except Exception as e:
+            with self._lock:
+                self._in_flight.pop(tag, None)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._store(tag, player)
+            self._in_flight.pop(tag, None)
+        future.set_result(player)
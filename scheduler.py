@@ -0,0 +1,145 @@
+# === АДАПТИВНОЕ РАСПИСАНИЕ ОПРОСА ===
+# Вместо "раз в час опросить всех" у каждого тега своё время следующей проверки.
+# Если кубки игрока изменились, он снова проверяется через min_interval; если нет,
+# интервал удваивается до max_interval. Общая нагрузка считается как сумма
+# 3600 / интервал по всем тегам: если она больше бюджета запросов в час, все
+# интервалы равномерно растягиваются. Дополнительно за один тик выдаётся не больше
+# запросов, чем накопилось бюджета. Если бюджет не задан, он равен числу тегов —
+# по запросу на тег в час, как при старом опросе всех раз в час, — и пересчитывается
+# в sync при изменении списка тегов.
+#
+# Время проверок выравнивается по границам тиков (кратно tick секундам от начала
+# эпохи), поэтому расписание не "уплывает" на длительность самой проверки.
+# Часы передаются снаружи: SimulatedClock позволяет гонять расписание в тестах
+# без реального ожидания.
+import heapq
+import itertools
+import time
+import zlib
+
+
+class SystemClock:
+    def now(self):
+        return time.time()
+
+    def sleep_until(self, moment):
+        delay = moment - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return max(moment, time.time())
+
+
+class SimulatedClock:
+    def __init__(self, start=0.0):
+        self._now = float(start)
+
+    def now(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def sleep_until(self, moment):
+        self._now = max(self._now, moment)
+        return self._now
+
+
+class PollScheduler:
+    def __init__(self, budget_per_hour=None, min_interval=600, max_interval=6 * 3600, tick=60):
+        self.auto_budget = budget_per_hour is None
+        self.budget_per_hour = 0.0 if self.auto_budget else float(budget_per_hour)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.tick = tick
+        self._heap = []        # (когда, порядковый номер, тег)
+        self._due = {}         # тег -> актуальное время проверки (остальные записи в куче устарели)
+        self._interval = {}    # тег -> базовый интервал без растяжения
+        self._load = 0.0       # сумма 3600 / интервал, запросов в час
+        self._seq = itertools.count()
+        self._allowance = 0.0
+        self._allowance_at = None
+
+    def __len__(self):
+        return len(self._interval)
+
+    def __contains__(self, tag):
+        return tag in self._interval
+
+    def align(self, moment):
+        # Ближайшая граница тика не раньше moment
+        return -(-moment // self.tick) * self.tick
+
+    def next_tick(self, now):
+        return (now // self.tick + 1) * self.tick
+
+    def stretch(self):
+        return max(1.0, self._load / self.budget_per_hour) if self.budget_per_hour > 0 else 1.0
+
+    def interval(self, tag):
+        return self._interval[tag] * self.stretch()
+
+    def add(self, tag, now):
+        if tag in self._interval:
+            if tag not in self._due:
+                # Тег выдан pop_due, но так и не перепланирован (тик упал) — возвращаем в расписание
+                self._push(tag, now)
+            return
+        self._set_interval(tag, self.min_interval)
+        # Разносим первые проверки по интервалу, чтобы не опрашивать всех в один тик
+        offset = zlib.crc32(tag.encode()) % max(1, int(self.interval(tag)))
+        self._push(tag, now + offset)
+
+    def remove(self, tag):
+        self._due.pop(tag, None)
+        if tag in self._interval:
+            self._load -= 3600 / self._interval.pop(tag)
+
+    def sync(self, tags, now):
+        # Добавляет новые теги и убирает те, которых больше нет в хранилище. Вызывается
+        # между тиками, поэтому тег без срока здесь — потерянный после ошибки в тике
+        tags = set(tags)
+        for tag in [t for t in self._interval if t not in tags]:
+            self.remove(tag)
+        for tag in tags:
+            self.add(tag, now)
+        if self.auto_budget:
+            self.budget_per_hour = float(len(self._interval))
+
+    def pop_due(self, now):
+        # Теги, которые пора проверить, но не больше накопленного бюджета
+        if self._allowance_at is not None:
+            self._allowance += self.budget_per_hour * (now - self._allowance_at) / 3600
+        else:
+            self._allowance = self.budget_per_hour * self.tick / 3600
+        self._allowance = min(self._allowance, self.budget_per_hour * self.tick * 2 / 3600 + 1)
+        self._allowance_at = now
+
+        due = []
+        while self._heap and self._heap[0][0] <= now and self._allowance >= 1:
+            moment, _, tag = heapq.heappop(self._heap)
+            if self._due.get(tag) != moment:
+                continue
+            del self._due[tag]
+            due.append(tag)
+            self._allowance -= 1
+        return due
+
+    def reschedule(self, tag, changed, now):
+        # Вызывается после проверки тега, взятого из pop_due
+        if tag not in self._interval:
+            return
+        base = self.min_interval if changed else min(self._interval[tag] * 2, self.max_interval)
+        self._set_interval(tag, base)
+        self._push(tag, now + self.interval(tag))
+
+    def _set_interval(self, tag, interval):
+        old = self._interval.get(tag)
+        if old is not None:
+            self._load -= 3600 / old
+        self._interval[tag] = interval
+        self._load += 3600 / interval
+
+    def _push(self, tag, moment):
+        moment = self.align(moment)
+        self._due[tag] = moment
+        heapq.heappush(self._heap, (moment, next(self._seq), tag))
@@ -0,0 +1,223 @@
+# === ОЧЕРЕДЬ ИСХОДЯЩИХ СООБЩЕНИЙ ===
+# Все сообщения бота проходят через одну очередь. Обработчики только кладут текст
+# в очередь и сразу возвращаются, а отправкой занимаются несколько фоновых потоков:
+#  - общий лимит Telegram (~30 сообщений в секунду) — ведро токенов;
+#  - лимит на чат: не чаще раза в секунду в личку и 20 раз в минуту в группу;
+#  - на 429 ждём столько, сколько сказал Telegram (retry_after), и шлём снова;
+#  - длинный текст режется по строкам на куски до 4096 символов так, чтобы
+#    HTML-теги не разрывались (открытые теги закрываются и открываются заново);
+#  - несколько мелких сообщений, ждущих отправки в один чат, склеиваются в одно.
+import heapq
+import itertools
+import re
+import threading
+import time
+from collections import deque
+
+from fetcher import TokenBucket
+
+MAX_MESSAGE_LENGTH = 4096
+TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*>')
+
+
+def _tag_stack_after(line, stack):
+    # Обновляет стек открытых тегов [(имя, открывающий тег), ...] по строке
+    for match in TAG_RE.finditer(line):
+        name = match.group(2).lower()
+        if not match.group(1):
+            stack.append((name, match.group(0)))
+            continue
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i]
+                break
+    return stack
+
+
+def _closing(stack):
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def _opening(stack):
+    return "".join(tag for _, tag in stack)
+
+
+def _hard_split(line, size):
+    # Режет слишком длинную строку, не попадая внутрь тега или HTML-сущности
+    pieces = []
+    while len(line) > size:
+        cut = size
+        lt, amp = line.rfind('<', 0, cut), line.rfind('&', 0, cut)
+        if lt > line.rfind('>', 0, cut):
+            cut = lt
+        if amp > line.rfind(';', 0, cut):
+            cut = min(cut, amp)
+        space = line.rfind(' ', 0, cut)
+        if space > size // 2:
+            cut = space + 1
+        if cut <= 0:
+            cut = size
+        pieces.append(line[:cut])
+        line = line[cut:]
+    pieces.append(line)
+    return pieces
+
+
+def split_message(text, parse_mode=None, limit=MAX_MESSAGE_LENGTH):
+    if len(text) <= limit:
+        return [text]
+    is_html = (parse_mode or '').upper() == 'HTML'
+    chunks, lines, stack = [], [], []
+    prefix, length = "", 0
+    # Запас под закрывающие теги, которые придётся дописать в конец куска
+    reserve = 64 if is_html else 0
+
+    for line in text.split("\n"):
+        for piece in _hard_split(line, limit - reserve - len(prefix) - 1):
+            if lines and length + 1 + len(piece) + reserve > limit:
+                chunks.append(prefix + "\n".join(lines) + (_closing(stack) if is_html else ""))
+                prefix = _opening(stack) if is_html else ""
+                lines, length = [], len(prefix)
+            lines.append(piece)
+            length += len(piece) + (1 if len(lines) > 1 else 0)
+            if is_html:
+                _tag_stack_after(piece, stack)
+    if lines:
+        chunks.append(prefix + "\n".join(lines))
+    return chunks
+
+
+class _Message:
+    def __init__(self, text, parse_mode, kwargs):
+        self.text = text
+        self.parse_mode = parse_mode
+        self.kwargs = kwargs
+        self.attempts = 0
+
+    def can_merge(self, other, limit):
+        return (not self.kwargs and not other.kwargs and self.parse_mode == other.parse_mode
+                and len(self.text) + 2 + len(other.text) <= limit)
+
+
+class OutboundQueue:
+    def __init__(self, send, retry_after=None, global_rate=30, private_interval=1.0, group_interval=3.0,
+                 workers=2, max_attempts=5, limit=MAX_MESSAGE_LENGTH):
+        self._send = send
+        self._retry_after = retry_after or (lambda e: None)
+        self._bucket = TokenBucket(global_rate)
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.limit = limit
+        self._chats = {}      # chat_id -> deque сообщений
+        self._next_at = {}    # chat_id -> когда можно слать следующее
+        self._busy = set()    # чаты, в которые сейчас идёт отправка
+        self._ready = []      # куча (когда, порядковый номер, chat_id) для небусых чатов с очередью
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.merged = 0
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def depth(self):
+        return self._pending
+
+    def send(self, chat_id, text, parse_mode=None, **kwargs):
+        # Никогда не блокирует: сообщение просто встаёт в очередь чата
+        chunks = split_message(text, parse_mode, self.limit)
+        with self._cond:
+            queue = self._chats.setdefault(chat_id, deque())
+            was_idle = not queue
+            for i, chunk in enumerate(chunks):
+                # Ответ (reply) и клавиатура относятся только к первому куску
+                queue.append(_Message(chunk, parse_mode, kwargs if i == 0 else {}))
+            self._pending += len(chunks)
+            if was_idle and chat_id not in self._busy:
+                if self._next_at.get(chat_id, 0.0) <= time.monotonic():
+                    self._next_at.pop(chat_id, None)
+                self._schedule(chat_id)
+            self._cond.notify()
+
+    def close(self, timeout=10):
+        # Даём очереди дослаться перед выходом
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+
+    def _schedule(self, chat_id, not_before=0.0):
+        at = max(self._next_at.get(chat_id, 0.0), not_before)
+        heapq.heappush(self._ready, (at, next(self._seq), chat_id))
+
+    def _interval(self, chat_id):
+        return self.group_interval if chat_id < 0 else self.private_interval
+
+    def _take(self):
+        # Ждёт чат, в который уже можно слать, и забирает из него сообщение (со склейкой)
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                at, _, chat_id = self._ready[0]
+                if at > now:
+                    self._cond.wait(at - now)
+                    continue
+                delay = self._bucket.try_acquire()
+                if delay:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._ready)
+                queue = self._chats[chat_id]
+                message = queue.popleft()
+                taken = 1
+                while queue and message.can_merge(queue[0], self.limit):
+                    nxt = queue.popleft()
+                    message = _Message(message.text + "\n\n" + nxt.text, message.parse_mode, {})
+                    taken += 1
+                self.merged += taken - 1
+                self._busy.add(chat_id)
+                return chat_id, message, taken
+
+    def _work(self):
+        while True:
+            chat_id, message, taken = self._take()
+            retry_after = None
+            try:
+                self._send(chat_id, message.text, parse_mode=message.parse_mode, **message.kwargs)
+                self.sent += 1
+            except Exception as e:
+                retry_after = self._retry_after(e)
+                message.attempts += 1
+                if retry_after is None or message.attempts >= self.max_attempts:
+                    self.failed += 1
+                    retry_after = None
+                    print(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+
+            with self._cond:
+                self._busy.discard(chat_id)
+                queue = self._chats[chat_id]
+                if retry_after is not None:
+                    queue.appendleft(message)
+                    self._pending += 1
+                    self._next_at[chat_id] = time.monotonic() + retry_after
+                else:
+                    self._next_at[chat_id] = time.monotonic() + self._interval(chat_id)
+                self._pending -= taken
+                if queue:
+                    self._schedule(chat_id)
+                else:
+                    # Срок для чата остаётся и после опустевшей очереди: следующее сообщение
+                    # тоже должно выждать интервал. Устаревший срок уберёт send
+                    del self._chats[chat_id]
+                self._cond.notify_all()
@@ -0,0 +1,251 @@
+# === СТАТИСТИКА ===
+# Счётчики и гистограммы задержек, которые можно держать включёнными всегда.
+# Запись идёт без блокировок: у каждого потока свой массив (array) на метрику, и
+# наблюдение — это бинарный поиск по фиксированным границам корзин и пара
+# "+=" в этот массив: ни списков, ни словарей на каждое наблюдение, память под
+# метрику не растёт. Блокировка берётся только при
+# первом наблюдении из нового потока и при чтении, когда массивы всех потоков
+# складываются. Массивы завершившихся потоков (например, пулов трекера)
+# сворачиваются в общий итог, чтобы не копиться.
+#
+# Вывод: render_text() — для команды /stats, render_prometheus() — текстовый
+# формат Prometheus, который отдаёт make_server() (переменная STATS_PORT в main.py).
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин в секундах: от 1 мс до 2 минут
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Sharded:
+    def __init__(self, size, typecode):
+        self._size = size
+        self._typecode = typecode
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []      # (поток, его массив)
+        self._retired = self._new_shard()
+
+    def _new_shard(self):
+        return array(self._typecode, [0]) * self._size
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+        shard = self._new_shard()
+        with self._lock:
+            alive = []
+            for thread, old in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, old))
+                else:
+                    for i, value in enumerate(old):
+                        self._retired[i] += value
+            alive.append((threading.current_thread(), shard))
+            self._shards = alive
+        self._local.shard = shard
+        return shard
+
+    def _totals(self):
+        with self._lock:
+            totals = array(self._typecode, self._retired)
+            for _, shard in self._shards:
+                for i, value in enumerate(shard):
+                    totals[i] += value
+        return totals
+
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    def __init__(self):
+        super().__init__(1, 'q')
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    def value(self):
+        return self._totals()[0]
+
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # [корзины..., +Inf, сумма]
+        super().__init__(len(self.buckets) + 2, 'd')
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        # (число наблюдений по корзинам, сумма)
+        totals = self._totals()
+        return list(totals[:-1]), totals[-1]
+
+    def count(self):
+        return int(sum(self._totals()[:-1]))
+
+    def sum(self):
+        return self._totals()[-1]
+
+    def quantile(self, q, counts=None):
+        # Оценка по корзинам с линейной интерполяцией внутри корзины (как histogram_quantile)
+        counts = counts if counts is not None else self.snapshot()[0]
+        total = sum(counts)
+        if not total:
+            return math.nan
+        rank, seen, lower = q * total, 0, 0.0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1] if self.buckets else math.inf
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = self.buckets[i] if i < len(self.buckets) else lower
+        return self.buckets[-1]
+
+
+class Callback:
+    # Значение, которое считается при чтении (глубина очереди, счётчик из другого объекта)
+    def __init__(self, fn, kind='gauge'):
+        self.fn = fn
+        self.kind = kind
+
+    def value(self):
+        return self.fn()
+
+
+def timed(histogram):
+    # Декоратор: время выполнения функции попадает в гистограмму, даже если она упала
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def _labels_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+class Registry:
+    def __init__(self, prefix='bot'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._help = {}
+        self._metrics = {}     # (имя, метки) -> метрика, в порядке регистрации
+
+    def _get(self, name, help_text, labels, factory):
+        name = f"{self.prefix}_{name}" if self.prefix else name
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = factory()
+                self._help.setdefault(name, help_text)
+            return metric
+
+    def counter(self, name, help_text, **labels):
+        return self._get(name, help_text, labels, Counter)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        return self._get(name, help_text, labels, lambda: Histogram(buckets))
+
+    def callback(self, name, help_text, fn, kind='gauge', **labels):
+        return self._get(name, help_text, labels, lambda: Callback(fn, kind))
+
+    def _grouped(self):
+        with self._lock:
+            items = list(self._metrics.items())
+        groups = {}
+        for (name, labels), metric in items:
+            groups.setdefault(name, []).append((labels, metric))
+        return groups
+
+    def render_prometheus(self):
+        lines = []
+        for name, metrics in self._grouped().items():
+            lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {metrics[0][1].kind}")
+            for labels, metric in metrics:
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_labels_text(labels)} {_number(metric.value())}")
+                    continue
+                counts, total = metric.snapshot()
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), counts):
+                    cumulative += count
+                    bucket_labels = labels + (('le', _number(float(bound))),)
+                    lines.append(f"{name}_bucket{_labels_text(bucket_labels)} {_number(cumulative)}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {total!r}")
+                lines.append(f"{name}_count{_labels_text(labels)} {_number(cumulative)}")
+        return "\n".join(lines) + "\n"
+
+    def render_text(self):
+        # Коротко для человека: гистограммы — число, среднее, p50/p90/p99 в миллисекундах
+        lines = []
+        for name, metrics in self._grouped().items():
+            short = name[len(self.prefix) + 1:] if self.prefix else name
+            for labels, metric in metrics:
+                title = short + (' ' + ' '.join(str(value) for _, value in labels) if labels else '')
+                if metric.kind != 'histogram':
+                    value = metric.value()
+                    lines.append(f"{title}: {value:.2f}" if isinstance(value, float) else f"{title}: {value}")
+                    continue
+                counts, total = metric.snapshot()
+                count = int(sum(counts))
+                if not count:
+                    lines.append(f"{title}: нет данных")
+                    continue
+                p50, p90, p99 = (metric.quantile(q, counts) * 1000 for q in (0.5, 0.9, 0.99))
+                lines.append(f"{title}: n={count} avg={total / count * 1000:.1f} "
+                             f"p50={p50:.1f} p90={p90:.1f} p99={p99:.1f} мс")
+        return "\n".join(lines)
+
+
+def make_server(host, port, registry, path='/metrics'):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != path:
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), MetricsHandler)
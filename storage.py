@@ -0,0 +1,493 @@
+# === ДВИЖКИ ХРАНЕНИЯ ===
+# PlayerStore (store.py) держит всё в памяти и пачками отдаёт сюда записи-операции.
+# Движок выбирается переменной STORAGE_BACKEND:
+#  - json    — снимок tracked_players.json + журнал (по умолчанию, как раньше);
+#  - sqlite  — один файл БД, сырые точки в points, часовые/суточные корзины в rollups,
+#              WAL, пачка = транзакция;
+#  - mongodb — коллекции players/points/rollups, пачка = один bulk_write на коллекцию.
+# Что движок должен уметь, перечислено в StorageBackend. У движков БД кроме записи есть
+# выборка истории за промежуток и лидерборд прямо из хранилища (без загрузки в память) —
+# для отладки и сверки с индексом; ярус для запроса выбирается по тому же правилу, что и
+# в памяти (history.tier_for_span). У JSON-движка таких выборок нет: всё и так в памяти.
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from history import ALL_TIME, TIERS, History, tier_for_span
+from store import apply_record, records_from_players
+
+BUCKET_TIERS = [(name, width) for name, width, _ in TIERS if width]
+
+
+def leaderboard_from_histories(players, game, since, limit, now=None):
+    # Та же логика прироста, что и в leaderboard.py (since=None — "за всё время")
+    now = time.time() if now is None else now
+    period_seconds = ALL_TIME if since is None else now - since
+    rows = []
+    for tag, data in players.items():
+        history = data.get('history')
+        if data.get('game') != game or not history:
+            continue
+        gain, _ = history.gain(period_seconds, now)
+        if gain > 0:
+            rows.append({'tag': tag, 'name': data.get('name', tag), 'gain': gain, 'current': history.last()})
+    rows.sort(key=lambda row: row['gain'], reverse=True)
+    return rows[:limit]
+
+
+def _leaderboard_tier(since, now):
+    # За всё время база — самое первое значение, оно есть в самом долгом ярусе
+    if since is None:
+        return TIERS[-1][:2]
+    return tier_for_span(now - since)
+
+
+class StorageBackend:
+    # Общий интерфейс движков. PlayerStore пишет через write и, если snapshots = True,
+    # периодически целиком через serialize/write_snapshot; migrate_from_json смотрит is_empty
+    name = None
+    snapshots = False
+
+    def is_empty(self):
+        raise NotImplementedError
+
+    def load_all(self):
+        # {тег: {'name', 'game', 'club'?, 'history': History}}
+        raise NotImplementedError
+
+    def write(self, records):
+        # Пачка записей-операций из store.py
+        raise NotImplementedError
+
+    def wants_snapshot(self):
+        return False
+
+    def serialize(self, players):
+        raise NotImplementedError
+
+    def write_snapshot(self, payload):
+        raise NotImplementedError
+
+    def history(self, game, tag, start=None, end=None):
+        # [(время, кубки)] за промежуток — только у движков БД
+        raise NotImplementedError
+
+    def leaderboard(self, game, since=None, limit=10, now=None):
+        # [{'tag', 'name', 'gain', 'current'}] — только у движков БД, since=None — "за всё время"
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonJournalBackend(StorageBackend):
+    name = 'json'
+    snapshots = True
+
+    def __init__(self, path, compact_every=5000, compact_interval=3600):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self._journal_records = 0
+        self._compacted_at = time.monotonic()
+
+    def is_empty(self):
+        # Нужно только для переноса при первом запуске — можно и прочитать файл целиком
+        return not self.load_all()
+
+    def load_all(self):
+        players = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                players = json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError as e:
+            broken_path = f"{self.path}.broken-{int(time.time())}"
+            os.replace(self.path, broken_path)
+            print(f"!!! Файл {self.path} повреждён ({e}), сохранён как {broken_path}. Начинаю с пустого списка.")
+
+        # Старый формат (список точек) переводится в ярусы здесь же. Первый же снимок
+        # перезапишет файл в новом формате, поэтому прежний файл один раз копируется в
+        # .v1 — с ним можно откатиться на версию, которая понимает только список точек
+        if any(isinstance(data.get('history'), list) for data in players.values()):
+            self._backup_legacy()
+        for data in players.values():
+            data['history'] = History.from_json(data.get('history'))
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # недописанная строка после падения
+                    apply_record(players, record)
+        except FileNotFoundError:
+            pass
+        return players
+
+    def _backup_legacy(self):
+        backup_path = self.path + '.v1'
+        if os.path.exists(backup_path):
+            return
+        shutil.copy2(self.path, backup_path)
+        print(f"Файл {self.path} в старом формате, копия сохранена как {backup_path}.")
+
+    def write(self, records):
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_records += len(records)
+
+    def wants_snapshot(self):
+        return (self._journal_records >= self.compact_every
+                or time.monotonic() - self._compacted_at >= self.compact_interval)
+
+    def serialize(self, players):
+        return json.dumps(players, ensure_ascii=False, default=History.to_json)
+
+    def write_snapshot(self, payload):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # Если упадём до этой строки, повторное проигрывание журнала ничего не испортит
+        open(self.journal_path, 'w').close()
+        self._journal_records = 0
+        self._compacted_at = time.monotonic()
+
+
+class SQLiteBackend(StorageBackend):
+    name = 'sqlite'
+    snapshots = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            tag TEXT PRIMARY KEY,
+            game TEXT NOT NULL,
+            name TEXT NOT NULL,
+            club TEXT,
+            origin INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS points (
+            game TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            trophies INTEGER NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS points_game_tag_timestamp ON points (game, tag, timestamp);
+        CREATE TABLE IF NOT EXISTS rollups (
+            game TEXT NOT NULL,
+            tier TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            first INTEGER NOT NULL,
+            last INTEGER NOT NULL,
+            low INTEGER NOT NULL,
+            high INTEGER NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS rollups_game_tier_tag_start ON rollups (game, tier, tag, start);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Пишет фоновый поток хранилища, читать могут другие — соединение общее под блокировкой
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(self.SCHEMA)
+            self._upgrade()
+
+    def _upgrade(self):
+        # БД от версии без ярусов: добавляем origin и строим корзины по уже сохранённым точкам
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(players)')]
+        if 'origin' in columns:
+            return
+        with self._conn:
+            self._conn.execute('ALTER TABLE players ADD COLUMN origin INTEGER')
+            points = defaultdict(list)
+            rows = self._conn.execute('SELECT game, tag, timestamp, trophies FROM points ORDER BY game, tag, timestamp')
+            for game, tag, timestamp, trophies in rows:
+                points[game, tag].append({'timestamp': timestamp, 'trophies': trophies})
+            for (game, tag), history in points.items():
+                self._write_history(game, tag, History.from_json(history))
+        print(f"База {self.path} переведена на хранение истории ярусами: {len(points)} игроков.")
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM players LIMIT 1').fetchone() is None
+
+    def load_all(self):
+        players, origins = {}, {}
+        raw, buckets = defaultdict(list), defaultdict(lambda: defaultdict(list))
+        with self._lock:
+            for tag, game, name, club, origin in self._conn.execute(
+                    'SELECT tag, game, name, club, origin FROM players'):
+                players[tag] = {'name': name, 'game': game}
+                origins[tag] = origin
+                if club:
+                    players[tag]['club'] = club
+            rows = self._conn.execute('SELECT tag, timestamp, trophies FROM points ORDER BY game, tag, timestamp')
+            for tag, timestamp, trophies in rows:
+                raw[tag].append((timestamp, trophies))
+            rows = self._conn.execute('SELECT tier, tag, start, first, last, low, high FROM rollups '
+                                      'ORDER BY game, tier, tag, start')
+            for tier, tag, *row in rows:
+                buckets[tag][tier].append(row)
+        for tag, data in players.items():
+            data['history'] = History.from_rows(origins[tag], raw.get(tag, ()), buckets.get(tag, {}))
+        return players
+
+    def _add_point(self, game, tag, timestamp, trophies):
+        self._conn.execute('INSERT OR IGNORE INTO points VALUES (?, ?, ?, ?)', (game, tag, timestamp, trophies))
+        for tier, width in BUCKET_TIERS:
+            self._conn.execute(
+                'INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(game, tier, tag, start) DO UPDATE SET '
+                'last = excluded.last, low = MIN(low, excluded.low), high = MAX(high, excluded.high)',
+                (game, tier, tag, timestamp - timestamp % width, trophies, trophies, trophies, trophies))
+        self._conn.execute('UPDATE players SET origin = ? WHERE tag = ? AND origin IS NULL', (timestamp, tag))
+
+    def _write_history(self, game, tag, history):
+        # Полная замена истории тега (перенос из JSON и обновление старой БД)
+        self._conn.execute('DELETE FROM points WHERE game = ? AND tag = ?', (game, tag))
+        self._conn.execute('DELETE FROM rollups WHERE game = ? AND tag = ?', (game, tag))
+        self._conn.executemany('INSERT INTO points VALUES (?, ?, ?, ?)',
+                               ((game, tag, t, v) for t, v in zip(*history.raw.arrays())))
+        for tier in (history.hour, history.day):
+            self._conn.executemany('INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                   ((game, tier.name, tag, *row) for row in zip(*tier.arrays())))
+        self._conn.execute('UPDATE players SET origin = ? WHERE tag = ?', (history.origin, tag))
+
+    def write(self, records):
+        with self._lock, self._conn:
+            for record in records:
+                op = record['op']
+                if op == 'upsert':
+                    self._conn.execute(
+                        'INSERT INTO players (tag, game, name) VALUES (?, ?, ?) '
+                        'ON CONFLICT(tag) DO UPDATE SET game = excluded.game, name = excluded.name',
+                        (record['tag'], record['game'], record['name']))
+                elif op == 'point':
+                    self._add_point(record['game'], record['tag'], record['timestamp'], record['trophies'])
+                elif op == 'club':
+                    self._conn.execute('UPDATE players SET club = ? WHERE tag = ?', (record['club'], record['tag']))
+                elif op == 'prune':
+                    game, tag = record['game'], record['tag']
+                    for tier, keep_from in record['cutoffs'].items():
+                        if tier == 'raw':
+                            self._conn.execute('DELETE FROM points WHERE game = ? AND tag = ? AND timestamp < ?',
+                                               (game, tag, keep_from))
+                        else:
+                            self._conn.execute('DELETE FROM rollups WHERE game = ? AND tier = ? AND tag = ? '
+                                               'AND start < ?', (game, tier, tag, keep_from))
+                elif op == 'history':
+                    self._write_history(record['game'], record['tag'], History.from_json(record['history']))
+
+    def _tier_source(self, tier):
+        # Ярус как таблица (tag, start, first, last): у сырых точек всё это — сама точка
+        if tier == 'raw':
+            return 'SELECT tag, timestamp AS start, trophies AS first, trophies AS last FROM points WHERE game = :game'
+        return 'SELECT tag, start, first, last FROM rollups WHERE game = :game AND tier = :tier'
+
+    def history(self, game, tag, start=None, end=None):
+        tier, _ = tier_for_span((time.time() if end is None else end) - (start or 0))
+        query = f'SELECT start, last FROM ({self._tier_source(tier)}) WHERE tag = :tag'
+        params = {'game': game, 'tier': tier, 'tag': tag}
+        if start is not None:
+            query += ' AND start >= :start'
+            params['start'] = start
+        if end is not None:
+            query += ' AND start < :end'
+            params['end'] = end
+        with self._lock:
+            return self._conn.execute(query + ' ORDER BY start', params).fetchall()
+
+    def leaderboard(self, game, since=None, limit=10, now=None):
+        # Для каждого тега в подходящем ярусе: последняя корзина (текущие кубки), последняя
+        # точка раньше since или корзина, закончившаяся не позже since, и самая первая — всё
+        # это MIN/MAX по индексу
+        tier, width = _leaderboard_tier(since, time.time() if now is None else now)
+        base_condition = 'start <= :boundary' if width else 'start < :boundary'
+        query = f"""
+            WITH src AS ({self._tier_source(tier)}),
+                 last AS (SELECT tag, MAX(start) AS start FROM src GROUP BY tag),
+                 first AS (SELECT tag, MIN(start) AS start FROM src GROUP BY tag),
+                 base AS (SELECT tag, MAX(start) AS start FROM src WHERE {base_condition} GROUP BY tag)
+            SELECT last.tag, players.name, lp.last - COALESCE(bp.last, fp.first) AS gain, lp.last
+            FROM last
+            JOIN first ON first.tag = last.tag
+            LEFT JOIN base ON base.tag = last.tag
+            JOIN src lp ON lp.tag = last.tag AND lp.start = last.start
+            JOIN src fp ON fp.tag = first.tag AND fp.start = first.start
+            LEFT JOIN src bp ON bp.tag = base.tag AND bp.start = base.start
+            JOIN players ON players.tag = last.tag
+            WHERE gain > 0
+            ORDER BY gain DESC
+            LIMIT :limit
+        """
+        params = {'game': game, 'tier': tier, 'limit': limit,
+                  'boundary': since - width if since is not None else -1}
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [{'tag': tag, 'name': name, 'gain': gain, 'current': current} for tag, name, gain, current in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MongoBackend(StorageBackend):
+    name = 'mongodb'
+    snapshots = False
+
+    def __init__(self, uri, database='dolbobotik'):
+        # pymongo нужен только этому движку
+        import pymongo
+        self._pymongo = pymongo
+        self._client = pymongo.MongoClient(uri)
+        db = self._client[database]
+        self._players = db.players
+        self._points = db.points
+        self._rollups = db.rollups
+        self._points.create_index([('game', 1), ('tag', 1), ('timestamp', 1)], unique=True)
+        self._rollups.create_index([('game', 1), ('tier', 1), ('tag', 1), ('start', 1)], unique=True)
+
+    def is_empty(self):
+        return self._players.find_one({}, {'_id': 1}) is None
+
+    def load_all(self):
+        players, origins = {}, {}
+        raw, buckets = defaultdict(list), defaultdict(lambda: defaultdict(list))
+        for doc in self._players.find():
+            players[doc['_id']] = {'name': doc['name'], 'game': doc['game']}
+            origins[doc['_id']] = doc.get('origin')
+            if doc.get('club'):
+                players[doc['_id']]['club'] = doc['club']
+        for doc in self._points.find({}, {'_id': 0}).sort([('game', 1), ('tag', 1), ('timestamp', 1)]):
+            raw[doc['tag']].append((doc['timestamp'], doc['trophies']))
+        for doc in self._rollups.find({}, {'_id': 0}).sort([('game', 1), ('tier', 1), ('tag', 1), ('start', 1)]):
+            buckets[doc['tag']][doc['tier']].append(
+                (doc['start'], doc['first'], doc['last'], doc['low'], doc['high']))
+        for tag, data in players.items():
+            data['history'] = History.from_rows(origins[tag], raw.get(tag, ()), buckets.get(tag, {}))
+        return players
+
+    def write(self, records):
+        UpdateOne, DeleteMany, InsertOne = self._pymongo.UpdateOne, self._pymongo.DeleteMany, self._pymongo.InsertOne
+        player_ops, point_ops, rollup_ops = [], [], []
+        for record in records:
+            op, tag = record['op'], record['tag']
+            if op == 'upsert':
+                player_ops.append(UpdateOne({'_id': tag}, {'$set': {'name': record['name'], 'game': record['game']}},
+                                            upsert=True))
+            elif op == 'club':
+                player_ops.append(UpdateOne({'_id': tag}, {'$set': {'club': record['club']}}))
+            elif op == 'point':
+                game, timestamp, trophies = record['game'], record['timestamp'], record['trophies']
+                key = {'game': game, 'tag': tag, 'timestamp': timestamp}
+                point_ops.append(UpdateOne(key, {'$set': {'trophies': trophies}}, upsert=True))
+                for tier, width in BUCKET_TIERS:
+                    key = {'game': game, 'tier': tier, 'tag': tag, 'start': timestamp - timestamp % width}
+                    rollup_ops.append(UpdateOne(key, {'$setOnInsert': {'first': trophies}, '$set': {'last': trophies},
+                                                      '$min': {'low': trophies}, '$max': {'high': trophies}},
+                                                upsert=True))
+                player_ops.append(UpdateOne({'_id': tag}, {'$min': {'origin': timestamp}}))
+            elif op == 'prune':
+                for tier, keep_from in record['cutoffs'].items():
+                    if tier == 'raw':
+                        point_ops.append(DeleteMany({'game': record['game'], 'tag': tag,
+                                                     'timestamp': {'$lt': keep_from}}))
+                    else:
+                        rollup_ops.append(DeleteMany({'game': record['game'], 'tier': tier, 'tag': tag,
+                                                      'start': {'$lt': keep_from}}))
+            elif op == 'history':
+                # Полная замена истории тега (перенос из JSON)
+                game, history = record['game'], History.from_json(record['history'])
+                point_ops.append(DeleteMany({'game': game, 'tag': tag}))
+                point_ops.extend(InsertOne({'game': game, 'tag': tag, 'timestamp': t, 'trophies': v})
+                                 for t, v in zip(*history.raw.arrays()))
+                rollup_ops.append(DeleteMany({'game': game, 'tag': tag}))
+                for tier in (history.hour, history.day):
+                    rollup_ops.extend(InsertOne({'game': game, 'tier': tier.name, 'tag': tag, 'start': start,
+                                                 'first': first, 'last': last, 'low': low, 'high': high})
+                                      for start, first, last, low, high in zip(*tier.arrays()))
+                player_ops.append(UpdateOne({'_id': tag}, {'$set': {'origin': history.origin}}))
+        # Порядок внутри коллекции важен (точка, потом её обрезка), поэтому ordered=True
+        if player_ops:
+            self._players.bulk_write(player_ops, ordered=True)
+        if point_ops:
+            self._points.bulk_write(point_ops, ordered=True)
+        if rollup_ops:
+            self._rollups.bulk_write(rollup_ops, ordered=True)
+
+    def _tier_source(self, game, tier):
+        # (коллекция, начало конвейера) яруса в виде документов {tag, start, first, last}
+        if tier == 'raw':
+            return self._points, [
+                {'$match': {'game': game}},
+                {'$project': {'tag': 1, 'start': '$timestamp', 'first': '$trophies', 'last': '$trophies'}},
+            ]
+        return self._rollups, [{'$match': {'game': game, 'tier': tier}}]
+
+    def history(self, game, tag, start=None, end=None):
+        tier, _ = tier_for_span((time.time() if end is None else end) - (start or 0))
+        collection, pipeline = self._tier_source(game, tier)
+        pipeline.append({'$match': {'tag': tag}})
+        if start is not None or end is not None:
+            bounds = {}
+            if start is not None:
+                bounds['$gte'] = start
+            if end is not None:
+                bounds['$lt'] = end
+            pipeline.append({'$match': {'start': bounds}})
+        pipeline.append({'$sort': {'start': 1}})
+        return [(doc['start'], doc['last']) for doc in collection.aggregate(pipeline)]
+
+    def leaderboard(self, game, since=None, limit=10, now=None):
+        # Документ {start, last} сравнивается сначала по start, поэтому $max даёт последнюю
+        # точку раньше since или корзину, закончившуюся не позже since (или null, если таких нет)
+        tier, width = _leaderboard_tier(since, time.time() if now is None else now)
+        collection, pipeline = self._tier_source(game, tier)
+        before = {'$cond': [{'$lte' if width else '$lt': ['$start', since - width if since is not None else -1]},
+                            {'start': '$start', 'last': '$last'}, None]}
+        pipeline += [
+            {'$sort': {'tag': 1, 'start': 1}},
+            {'$group': {'_id': '$tag', 'first': {'$first': '$first'}, 'current': {'$last': '$last'},
+                        'base': {'$max': before}}},
+            {'$project': {'current': 1,
+                          'gain': {'$subtract': ['$current', {'$ifNull': ['$base.last', '$first']}]}}},
+            {'$match': {'gain': {'$gt': 0}}},
+            {'$sort': {'gain': -1}},
+            {'$limit': limit},
+            {'$lookup': {'from': self._players.name, 'localField': '_id', 'foreignField': '_id', 'as': 'player'}},
+        ]
+        return [{'tag': doc['_id'], 'name': doc['player'][0]['name'] if doc['player'] else doc['_id'],
+                 'gain': doc['gain'], 'current': doc['current']}
+                for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+    def close(self):
+        self._client.close()
+
+
+def migrate_from_json(backend, json_path):
+    # Первый запуск на пустой БД: переносим существующий tracked_players.json
+    if not os.path.exists(json_path) or not backend.is_empty():
+        return 0
+    players = JsonJournalBackend(json_path).load_all()
+    records = list(records_from_players(players))
+    for i in range(0, len(records), 5000):
+        backend.write(records[i:i + 5000])
+    print(f"Перенесено из {json_path} в {backend.name}: {len(players)} игроков.")
+    return len(players)
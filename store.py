@@ -0,0 +1,208 @@
+# === ХРАНИЛИЩЕ ОТСЛЕЖИВАЕМЫХ ИГРОКОВ ===
+# Все данные живут в памяти одного процесса под общей блокировкой. Изменения не
+# пишутся сразу: каждое изменение — это запись-операция ('upsert', 'point',
+# 'club', 'prune'), записи копятся в очереди, и фоновый поток пачкой отдаёт их
+# движку хранения (storage.py): JSON-журналу со снимками, SQLite или MongoDB.
+#
+# В памяти игрок — это {'name', 'game', 'history': History} плюс необязательное поле
+# 'club' — тег последнего известного клуба/клана. История хранится ярусами с
+# прореживанием (history.py); старый формат истории (список точек) переводится
+# в новый при загрузке.
+import threading
+import time
+from contextlib import contextmanager
+
+from history import History
+
+
+def apply_record(players, record):
+    # Применение идемпотентно: журнал, уже попавший в снимок, можно проиграть повторно
+    op, tag = record['op'], record['tag']
+    if op == 'upsert':
+        data = players.setdefault(tag, {'name': record['name'], 'game': record['game'], 'history': History()})
+        data.update({'name': record['name'], 'game': record['game']})
+        return
+    data = players.get(tag)
+    if data is None:
+        return
+    if op == 'point':
+        data['history'].append(record['timestamp'], record['trophies'])
+    elif op == 'club':
+        data['club'] = record['club']
+    elif op == 'prune' and 'cutoffs' in record:
+        # Записи старого формата ({'before': ...}) пропускаем: прореживание теперь своё
+        data['history'].prune_to(record['cutoffs'])
+    elif op == 'history':
+        data['history'] = History.from_json(record['history'])
+
+
+def records_from_players(players):
+    # Обратное превращение: словарь игроков -> записи (для переноса между движками)
+    for tag, data in players.items():
+        yield {'op': 'upsert', 'tag': tag, 'name': data.get('name', tag), 'game': data.get('game')}
+        if data.get('club'):
+            yield {'op': 'club', 'tag': tag, 'club': data['club']}
+        yield {'op': 'history', 'tag': tag, 'game': data.get('game'), 'history': data['history'].to_json()}
+
+
+class PlayerStore:
+    def __init__(self, backend, flush_interval=1.0, observe=None):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        # observe(операция, секунды) — замеры load/flush/snapshot для статистики
+        self._observe = observe or (lambda operation, seconds: None)
+        self._players = {}
+        self._pending = []
+        self._lock = threading.RLock()
+        self._io_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    # --- загрузка ---
+    def load(self):
+        started = time.perf_counter()
+        players = self.backend.load_all()
+        with self._lock:
+            self._players = players
+            self._pending = []
+        self._observe('load', time.perf_counter() - started)
+        # Снимочный движок сразу сворачивает журнал, чтобы начать с чистого снимка
+        self.compact()
+        print(f"Хранилище ({self.backend.name}) загружено: {len(self._players)} игроков.")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.compact()
+        self.backend.close()
+
+    # --- чтение ---
+    def __contains__(self, tag):
+        return tag in self._players
+
+    def __len__(self):
+        return len(self._players)
+
+    def get(self, tag):
+        # Копия без истории; историю читать через series()
+        with self._lock:
+            data = self._players.get(tag)
+            if data is None:
+                return None
+            return {key: value for key, value in data.items() if key != 'history'}
+
+    def series(self, tag, start=None, end=None):
+        with self._lock:
+            data = self._players.get(tag)
+            return data['history'].series(start, end) if data else []
+
+    def tags(self, game=None):
+        with self._lock:
+            return [tag for tag, data in self._players.items() if game is None or data.get('game') == game]
+
+    def clubs(self, game):
+        # {тег игрока: тег клуба} для игроков игры game с известным клубом
+        with self._lock:
+            return {tag: data['club'] for tag, data in self._players.items()
+                    if data.get('game') == game and data.get('club')}
+
+    def last_trophies(self, tag):
+        with self._lock:
+            data = self._players.get(tag)
+            return data['history'].last() if data else None
+
+    @contextmanager
+    def view(self):
+        # Прямой доступ к словарю игроков на время блока — только для чтения
+        with self._lock:
+            yield self._players
+
+    # --- изменения ---
+    def add_listener(self, listener):
+        # listener(tag) вызывается под блокировкой хранилища после каждого изменения игрока
+        self._listeners.append(listener)
+
+    def upsert_player(self, tag, name, game, trophies=None, timestamp=None):
+        # Возвращает True, если игрок добавлен впервые
+        with self._lock:
+            data = self._players.get(tag)
+            is_new = data is None
+            if is_new or data.get('name') != name or data.get('game') != game:
+                self._record({'op': 'upsert', 'tag': tag, 'name': name, 'game': game})
+            if is_new and trophies is not None:
+                self._record({'op': 'point', 'tag': tag, 'game': game, 'timestamp': int(timestamp or time.time()),
+                              'trophies': trophies})
+            return is_new
+
+    def append_point(self, tag, timestamp, trophies):
+        with self._lock:
+            timestamp = int(timestamp)  # история хранит целые секунды
+            data = self._players.get(tag)
+            last_timestamp = data['history'].last_timestamp() if data else None
+            # Точки только по возрастанию времени, иначе движки разошлись бы с памятью
+            if data is not None and (last_timestamp is None or timestamp > last_timestamp):
+                self._record({'op': 'point', 'tag': tag, 'game': data.get('game'), 'timestamp': timestamp,
+                              'trophies': trophies})
+
+    def set_club(self, tag, club):
+        with self._lock:
+            data = self._players.get(tag)
+            if data is not None and data.get('club') != club:
+                self._record({'op': 'club', 'tag': tag, 'club': club})
+
+    def prune_history(self, tag, now):
+        # Отрезает у каждого яруса истории всё старше его срока хранения (history.py)
+        with self._lock:
+            data = self._players.get(tag)
+            cutoffs = data['history'].prune_plan(now) if data else None
+            if cutoffs:
+                self._record({'op': 'prune', 'tag': tag, 'game': data.get('game'), 'cutoffs': cutoffs})
+
+    def _record(self, record):
+        apply_record(self._players, record)
+        self._pending.append(record)
+        for listener in self._listeners:
+            listener(record['tag'])
+
+    # --- запись на диск ---
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if self.backend.wants_snapshot():
+                    self.compact()
+            except Exception as e:
+                print(f"Ошибка записи хранилища: {e}")
+
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                # Одна пачка — одна транзакция/запрос в движке
+                started = time.perf_counter()
+                self.backend.write(pending)
+                self._observe('flush', time.perf_counter() - started)
+
+    def compact(self):
+        if not self.backend.snapshots:
+            self.flush()
+            return
+        with self._io_lock:
+            started = time.perf_counter()
+            with self._lock:
+                # Копию и очередь берём под одной блокировкой: всё из очереди уже есть в копии.
+                # Под блокировкой только копирование массивов, сериализация — уже без неё.
+                players = {tag: dict(data, history=data['history'].copy()) for tag, data in self._players.items()}
+                self._pending = []
+            payload = self.backend.serialize(players)
+            self.backend.write_snapshot(payload)
+            self._observe('snapshot', time.perf_counter() - started)
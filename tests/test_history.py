@@ -0,0 +1,48 @@
+# Прирост за период по ярусам истории против прямого подсчёта по всем точкам.
+#   python -m unittest discover tests
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import History  # noqa: E402
+
+DAY = 86400
+# Полночь UTC, чтобы часовые и суточные корзины начинались ровно с D
+D = 20000 * DAY
+
+
+def make_history(points):
+    history = History()
+    for timestamp, trophies in points:
+        history.append(timestamp, trophies)
+    return history
+
+
+class GainTest(unittest.TestCase):
+    def test_bucket_ending_at_boundary_is_base(self):
+        # Часовая корзина [D+3600, D+7200) заканчивается ровно на границе — все её точки раньше
+        history = make_history([(D + 600, 100), (D + 3000, 200), (D + 5400, 300), (D + 88200, 400)])
+        now = D + 7200 + DAY
+        self.assertEqual(history.hour.value_before(now - DAY, DAY)[0], 300)
+        self.assertEqual(history.gain(DAY, now)[0], 100)
+        self.assertEqual(history.gain(DAY, D + 90000)[0], 200)
+
+    def test_day_gain_uses_exact_points(self):
+        # Граница внутри часа: по часовым корзинам база была бы 50, по точкам — 100
+        history = make_history([(D + 100, 50), (D + 3700, 100), (D + 4000, 200), (D + 5000, 300)])
+        self.assertEqual(history.gain(DAY, D + 3900 + DAY)[0], 200)
+
+    def test_prune_keeps_base_point(self):
+        # Кубки не менялись три дня: точка старше RAW_KEEP нужна как база за день
+        now = D + 3 * DAY
+        history = make_history([(D, 100), (now, 150)])
+        history.prune_to(history.prune_plan(now))
+        self.assertEqual(len(history.raw), 2)
+        self.assertIs(history.pick_tier(DAY, now + 10 - DAY), history.raw)
+        self.assertEqual(history.gain(DAY, now + 10)[0], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# Расписание опроса на SimulatedClock: без сети и без реального ожидания.
+#   python -m unittest discover tests
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import PollScheduler, SimulatedClock  # noqa: E402
+
+TAGS = [f'#TAG{i}' for i in range(200)]
+
+
+def run_hour(scheduler, clock, changed=False):
+    # Час работы трекера: на каждом тике выдаём должные теги и сразу их перепланируем
+    polled = []
+    end = clock.now() + 3600
+    while clock.now() < end:
+        now = clock.sleep_until(scheduler.next_tick(clock.now()))
+        for tag in scheduler.pop_due(now):
+            polled.append(tag)
+            scheduler.reschedule(tag, changed, now)
+    return polled
+
+
+class PollSchedulerTest(unittest.TestCase):
+    def test_budget_limits_requests(self):
+        # 200 тегов раз в 10 минут — это 1200 запросов в час, а бюджет 300
+        clock = SimulatedClock(1000)
+        scheduler = PollScheduler(300, min_interval=600, max_interval=600, tick=60)
+        scheduler.sync(TAGS, clock.now())
+        self.assertAlmostEqual(scheduler.stretch(), 4.0)
+        self.assertEqual(scheduler.interval(TAGS[0]), 2400)
+
+        run_hour(scheduler, clock, changed=True)
+        polled = run_hour(scheduler, clock, changed=True)
+        # Запас — не больше накопленного за два тика остатка
+        self.assertLessEqual(len(polled), 300 + 300 * 60 * 2 / 3600 + 1)
+        self.assertGreaterEqual(len(polled), 200 * 3600 / 2400 * 0.9)
+
+    def test_default_budget_is_one_request_per_tag_per_hour(self):
+        # Даже если кубки меняются при каждой проверке, запросов не больше, чем при опросе
+        # всех раз в час
+        tags = [f'#TAG{i}' for i in range(1000)]
+        clock = SimulatedClock(1000)
+        scheduler = PollScheduler(min_interval=600, max_interval=6 * 3600, tick=60)
+        scheduler.sync(tags, clock.now())
+        self.assertEqual(scheduler.budget_per_hour, 1000)
+        run_hour(scheduler, clock, changed=True)
+        polled = run_hour(scheduler, clock, changed=True)
+        self.assertLessEqual(len(polled), 1000 + 1000 * 60 * 2 / 3600 + 1)
+
+        scheduler.sync(tags[:500], clock.now())
+        self.assertEqual(scheduler.budget_per_hour, 500)
+
+    def test_unchanged_tag_backs_off(self):
+        clock = SimulatedClock(0)
+        scheduler = PollScheduler(10 ** 6, min_interval=600, max_interval=4800, tick=60)
+        scheduler.sync(['#A'], clock.now())
+        intervals = []
+        for _ in range(5):
+            scheduler.reschedule('#A', False, clock.now())
+            intervals.append(scheduler.interval('#A'))
+        self.assertEqual(intervals, [1200, 2400, 4800, 4800, 4800])
+
+        scheduler.reschedule('#A', True, clock.now())
+        self.assertEqual(scheduler.interval('#A'), 600)
+
+    def test_checks_aligned_to_ticks(self):
+        clock = SimulatedClock(1000.5)
+        scheduler = PollScheduler(10 ** 6, min_interval=600, max_interval=600, tick=60)
+        scheduler.sync(TAGS[:20], clock.now())
+        # Проверка "затянулась" на 7 секунд, а следующая всё равно встаёт на границу тика
+        for _ in range(30):
+            now = clock.sleep_until(scheduler.next_tick(clock.now()))
+            self.assertEqual(now % 60, 0)
+            due = scheduler.pop_due(now)
+            clock.advance(7)
+            for tag in due:
+                scheduler.reschedule(tag, False, clock.now())
+        self.assertEqual(sum(moment % 60 for moment, _, _ in scheduler._heap), 0)
+
+    def test_sync_rearms_tags_lost_in_failed_tick(self):
+        clock = SimulatedClock(0)
+        scheduler = PollScheduler(10 ** 6, min_interval=600, tick=60)
+        scheduler.sync(['#A', '#B'], clock.now())
+        now = clock.sleep_until(600)
+        self.assertEqual(sorted(scheduler.pop_due(now)), ['#A', '#B'])
+        # Тик упал до reschedule: на следующем sync теги должны вернуться
+        scheduler.sync(['#A', '#B'], now)
+        now = clock.sleep_until(scheduler.next_tick(now))
+        self.assertEqual(sorted(scheduler.pop_due(now)), ['#A', '#B'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# Нарезка длинных сообщений и очередь отправки (429, reply, интервал между сообщениями в чат).
+#   python -m unittest discover tests
+import os
+import re
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from send_queue import MAX_MESSAGE_LENGTH, TAG_RE, OutboundQueue, split_message  # noqa: E402
+
+
+def open_tags(chunk):
+    # Теги, оставшиеся открытыми в конце куска (пусто — всё сбалансировано)
+    stack = []
+    for match in TAG_RE.finditer(chunk):
+        if match.group(1):
+            assert stack and stack[-1] == match.group(2), chunk
+            stack.pop()
+        else:
+            stack.append(match.group(2))
+    return stack
+
+
+class SplitMessageTest(unittest.TestCase):
+    def assertChunksValid(self, chunks):
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), MAX_MESSAGE_LENGTH)
+            self.assertEqual(open_tags(chunk), [])
+            # Ни одна HTML-сущность не разрезана
+            self.assertIsNone(re.search(r'&(?!amp;|lt;|gt;)', chunk))
+
+    def test_long_pre_block(self):
+        lines = [f"{i:04d} " + 'x' * 95 for i in range(120)]
+        text = "<b>Итоги</b>\n<pre>" + "\n".join(lines) + "</pre>"
+        chunks = split_message(text, 'HTML')
+        self.assertGreater(len(chunks), 2)
+        self.assertChunksValid(chunks)
+        for chunk in chunks[1:]:
+            self.assertTrue(chunk.startswith('<pre>'))
+        body = "\n".join(re.sub(r'</?pre>', '', chunk) for chunk in chunks)
+        self.assertEqual(body, re.sub(r'</?pre>', '', text))
+
+    def test_single_line_longer_than_message(self):
+        line = ' '.join(f'word{i}' for i in range(2500))
+        chunks = split_message(line)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks))
+        self.assertEqual("".join(chunks), line)
+
+    def test_nested_tags_reopened(self):
+        lines = [f'<a href="https://example.com/{i}">игрок {i}</a> &amp; ' + 'y' * 60 for i in range(200)]
+        text = "<i><b>Топ</b>\n<b>" + "\n".join(lines) + "</b></i>"
+        chunks = split_message(text, 'HTML')
+        self.assertGreater(len(chunks), 1)
+        self.assertChunksValid(chunks)
+        self.assertTrue(chunks[0].endswith('</b></i>'))
+        for chunk in chunks[1:]:
+            self.assertTrue(chunk.startswith('<i><b>'))
+
+    def test_cut_never_inside_entity_or_tag(self):
+        # Без сдвига граница пришлась бы внутрь &amp; и <b>
+        for filler in ('&amp;', '<b>z</b>'):
+            with self.subTest(filler=filler):
+                line = 'a' * (MAX_MESSAGE_LENGTH - 66) + filler * 300
+                chunks = split_message(line, 'HTML')
+                self.assertChunksValid(chunks)
+                self.assertEqual("".join(chunks).replace('</b><b>', ''), line.replace('</b><b>', ''))
+
+    def test_short_text_untouched(self):
+        self.assertEqual(split_message('<b>привет</b>', 'HTML'), ['<b>привет</b>'])
+
+
+class ThrottledError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'429, retry after {retry_after}')
+        self.retry_after = retry_after
+
+
+class FakeBot:
+    # Запоминает (время, чат, текст, kwargs); fail — сколько первых вызовов ответить 429
+    def __init__(self, fail=0, retry_after=0.3):
+        self.sent = []
+        self.calls = 0
+        self.fail = fail
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+            if self.calls <= self.fail:
+                raise ThrottledError(self.retry_after)
+            self.sent.append((time.monotonic(), chat_id, text, kwargs))
+
+
+def make_queue(bot, **options):
+    options.setdefault('private_interval', 0.05)
+    queue = OutboundQueue(bot.send_message, lambda e: getattr(e, 'retry_after', None), global_rate=1000,
+                          **options)
+    queue.start()
+    return queue
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def test_retry_after_429(self):
+        bot = FakeBot(fail=1, retry_after=0.3)
+        queue = make_queue(bot)
+        started = time.monotonic()
+        queue.send(1, 'первое')
+        queue.send(1, 'второе')
+        queue.close(timeout=5)
+        self.assertEqual(queue.depth(), 0)
+        self.assertEqual((queue.sent, queue.failed), (1, 0))
+        # Повтор не раньше retry_after, и порядок сообщений сохранён (оба ушли одним куском)
+        self.assertGreaterEqual(bot.sent[0][0] - started, 0.3)
+        self.assertEqual([text for _, _, text, _ in bot.sent], ['первое\n\nвторое'])
+
+    def test_gives_up_after_max_attempts(self):
+        bot = FakeBot(fail=10, retry_after=0.01)
+        queue = make_queue(bot, max_attempts=3)
+        queue.send(1, 'не дойдёт')
+        queue.close(timeout=5)
+        self.assertEqual((bot.calls, queue.sent, queue.failed, queue.depth()), (3, 0, 1, 0))
+
+    def test_reply_only_on_first_chunk(self):
+        bot = FakeBot()
+        queue = make_queue(bot)
+        text = "\n".join('z' * 100 for _ in range(100))
+        queue.send(1, text, reply_to_message_id=42)
+        queue.send(1, 'хвост')
+        queue.close(timeout=5)
+        kwargs = [sent_kwargs for _, _, _, sent_kwargs in bot.sent]
+        self.assertGreater(len(kwargs), 2)
+        self.assertEqual(kwargs[0], {'reply_to_message_id': 42})
+        self.assertTrue(all(not item for item in kwargs[1:]))
+        # Хвост без reply склеился с последним куском
+        self.assertEqual("\n".join(text for _, _, text, _ in bot.sent), text + "\n\nхвост")
+
+    def test_chat_interval(self):
+        bot = FakeBot()
+        queue = make_queue(bot, private_interval=0.2, group_interval=0.4)
+        for chat_id in (1, -1):
+            for i in range(3):
+                queue.send(chat_id, f'{chat_id}: {i}')
+                # Ждём отправки, чтобы сообщения не склеились
+                queue.close(timeout=5)
+        for chat_id, interval in ((1, 0.2), (-1, 0.4)):
+            times = [at for at, chat, _, _ in bot.sent if chat == chat_id]
+            self.assertEqual(len(times), 3)
+            for before, after in zip(times, times[1:]):
+                self.assertGreaterEqual(after - before, interval - 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
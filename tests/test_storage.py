@@ -0,0 +1,106 @@
+# SQLite-движок против того же прироста, посчитанного в памяти (leaderboard_from_histories).
+# История набирается так же, как это делает трекер: точки, смена клуба и прореживание
+# идут записями через PlayerStore.
+#   python -m unittest discover tests
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import JsonJournalBackend, SQLiteBackend, leaderboard_from_histories  # noqa: E402
+from store import PlayerStore  # noqa: E402
+
+DAY = 86400
+# Всё кратно получасу: точки и корзины попадают ровно на границы периодов
+NOW = 20000 * DAY + 5 * 3600
+GAMES = ('brawlstars', 'clashroyale')
+PERIODS = (None, DAY, 3 * DAY, 7 * DAY, 30 * DAY, 90 * DAY, 365 * DAY)
+
+
+def fill(store, tags=40, days=120, seed=0):
+    # Опрос раз в 1–8 часов, кубки меняются не всегда; часть игроков добавлена позже
+    rng = random.Random(seed)
+    for i in range(tags):
+        tag = f'#T{i}'
+        timestamp = NOW - rng.randint(DAY // 1800, days * DAY // 1800) * 1800
+        trophies = rng.randint(0, 30000)
+        store.upsert_player(tag, f'player{i}', GAMES[i % 2], trophies, timestamp)
+        if i % 3 == 0:
+            store.set_club(tag, f'#C{i % 4}')
+        while True:
+            timestamp += rng.randint(2, 16) * 1800
+            if timestamp > NOW:
+                break
+            if rng.random() < 0.4:
+                trophies = max(0, trophies + rng.randint(-30, 60))
+                store.append_point(tag, timestamp, trophies)
+            store.prune_history(tag, timestamp)
+
+
+def tier_columns(history):
+    return [(tier.name, [column.tolist() for column in tier.arrays()]) for tier in history.tiers()]
+
+
+class SQLiteBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.backend = SQLiteBackend(os.path.join(self.dir, 'players.sqlite3'))
+        self.store = PlayerStore(self.backend)
+        fill(self.store)
+        self.store.flush()
+        with self.store.view() as players:
+            self.players = players
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.dir)
+
+    def test_load_all_round_trip(self):
+        loaded = self.backend.load_all()
+        self.assertEqual(sorted(loaded), sorted(self.players))
+        for tag, data in self.players.items():
+            self.assertEqual({key: value for key, value in loaded[tag].items() if key != 'history'},
+                             {key: value for key, value in data.items() if key != 'history'})
+            self.assertEqual(loaded[tag]['history'].origin, data['history'].origin)
+            self.assertEqual(tier_columns(loaded[tag]['history']), tier_columns(data['history']))
+
+    def test_leaderboard_matches_memory(self):
+        for game in GAMES:
+            for period in PERIODS:
+                since = None if period is None else NOW - period
+                with self.subTest(game=game, period=period):
+                    expected = leaderboard_from_histories(self.players, game, since, 1000, NOW)
+                    got = self.backend.leaderboard(game, since, 1000, NOW)
+                    self.assertTrue(expected)
+                    # Порядок при равном приросте не задан
+                    self.assertEqual(sorted(map(sorted, (row.items() for row in got))),
+                                     sorted(map(sorted, (row.items() for row in expected))))
+
+    def test_history_matches_memory(self):
+        for tag, data in self.players.items():
+            for period in PERIODS[1:]:
+                with self.subTest(tag=tag, period=period):
+                    self.assertEqual(self.backend.history(data['game'], tag, NOW - period, NOW + 1),
+                                     data['history'].series(NOW - period, NOW + 1))
+
+
+class JsonJournalBackendTest(unittest.TestCase):
+    def test_is_empty(self):
+        directory = tempfile.mkdtemp()
+        try:
+            backend = JsonJournalBackend(os.path.join(directory, 'tracked_players.json'))
+            self.assertTrue(backend.is_empty())
+            store = PlayerStore(backend)
+            store.upsert_player('#A', 'a', 'brawlstars', 100, NOW)
+            store.flush()
+            self.assertFalse(backend.is_empty())
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
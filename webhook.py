@@ -0,0 +1,110 @@
+# === ВЕБХУК ===
+# Альтернатива infinity_polling: Telegram сам присылает обновления POST-запросами
+# на локальный HTTP-сервер. Сервер только кладёт обновление в очередь и сразу
+# отвечает 200, а обработчики крутятся в фиксированном пуле рабочих потоков.
+# Все обновления одного чата попадают в одну и ту же очередь, поэтому порядок
+# сообщений внутри чата сохраняется. Если очередь переполнена, обновление
+# отбрасывается (лучше потерять одно сообщение, чем копить бесконечный хвост).
+#
+# Проверить можно без Telegram: curl -X POST -d @update.json http://127.0.0.1:8443/webhook
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Поля Update, в которых лежит объект с чатом
+CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+               'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def update_chat_id(data):
+    for field in CHAT_FIELDS:
+        chat = (data.get(field) or {}).get('chat')
+        if chat:
+            return chat.get('id')
+    callback = data.get('callback_query')
+    if callback:
+        message = callback.get('message') or {}
+        return (message.get('chat') or {}).get('id') or (callback.get('from') or {}).get('id')
+    return data.get('update_id', 0)
+
+
+class UpdateDispatcher:
+    def __init__(self, handle, workers=8, queue_size=100):
+        self.handle = handle
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        for q in self._queues:
+            thread = threading.Thread(target=self._work, args=(q,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, data):
+        # Возвращает False, если обновление отброшено из-за переполнения
+        q = self._queues[hash(update_chat_id(data)) % len(self._queues)]
+        try:
+            q.put_nowait(data)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.accepted += 1
+        return True
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def _work(self, q):
+        while True:
+            data = q.get()
+            if data is None:
+                return
+            try:
+                self.handle(data)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"Ошибка обработки обновления {data.get('update_id')}: {e}")
+
+
+def make_server(host, port, path, dispatcher, secret_token=None):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != path:
+                self.send_error(404)
+                return
+            if secret_token and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+                self.send_error(403)
+                return
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                data = json.loads(body)
+            except (ValueError, UnicodeDecodeError):
+                data = None
+            if not isinstance(data, dict):
+                self.send_error(400)
+                return
+            # Отброшенное обновление тоже подтверждаем, иначе Telegram начнёт слать его повторно
+            dispatcher.submit(data)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass  # не засоряем вывод строкой на каждое обновление
+
+    return ThreadingHTTPServer((host, port), WebhookHandler)